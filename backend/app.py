@@ -1,11 +1,32 @@
+import io
 import os
+import atexit
+import re
+import math
+import random
+import csv
+import json
+import time
 import uuid
-from datetime import datetime
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+import click
+import jwt
 import psycopg2
 from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
-from flask import Flask, jsonify, request
+from psycopg2.errors import DuplicatePreparedStatement, InvalidSqlStatementName
+from psycopg2.extras import RealDictCursor, Json, execute_values
+from flask import Flask, Response, g, has_request_context, jsonify, request
 from flask_cors import CORS
+from PIL import Image, ImageOps
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
 from supabase import create_client, Client
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
@@ -14,6 +35,10 @@ load_dotenv()
 
 app = Flask(__name__)
 
+# Request body limit; Werkzeug answers 413 before reading anything larger
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_MB", "100")) * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
 # CORS Configuration
 CORS_ORIGINS = os.getenv(
     "CORS_ORIGINS",
@@ -35,11 +60,643 @@ CORS(
 
 print(f"✅ Orígenes CORS permitidos: {origins_list}")
 
+# --- Metrics ---
+# Prometheus metrics served at /metrics. Under gunicorn every worker writes
+# to the shared PROMETHEUS_MULTIPROC_DIR (set up in gunicorn.conf.py) and a
+# scrape aggregates all of them; without it the in-process registry is used.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Request latency by route',
+    ['method', 'route'], buckets=LATENCY_BUCKETS)
+HTTP_REQUESTS_TOTAL = Counter(
+    'http_requests_total', 'Requests by route and status code',
+    ['method', 'route', 'status'])
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    'db_pool_checkout_seconds', 'Time waiting for a pooled DB connection',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10))
+DB_POOL_TIMEOUTS_TOTAL = Counter(
+    'db_pool_timeouts_total', 'Checkouts that gave up waiting for a connection')
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Pooled DB connections by state (summed over live workers)',
+    ['state'], multiprocess_mode='livesum')
+SUPABASE_CALL_SECONDS = Histogram(
+    'supabase_call_duration_seconds', 'Supabase API call latency',
+    ['service', 'method'], buckets=LATENCY_BUCKETS)
+CACHE_REQUESTS_TOTAL = Counter(
+    'cache_requests_total', 'Cache lookups by result (hit ratio = hit / total)',
+    ['cache', 'result'])
+
+def report_pool_metrics():
+    if _db_pool is None:
+        return
+    stats = _db_pool.stats()
+    for state in ('in_use', 'idle', 'open', 'waiting'):
+        DB_POOL_CONNECTIONS.labels(state=state).set(stats[state])
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de texto de Prometheus, agregadas entre workers"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Unauthorized"}), 401
+    registry = None
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    report_pool_metrics()
+    data = generate_latest(registry) if registry else generate_latest()
+    return Response(data, content_type=CONTENT_TYPE_LATEST)
+
+# --- Request Timing ---
+# Per-request breakdown of where the time went: pool checkout, SQL (cursor
+# execute + commit/rollback), Supabase auth and Supabase storage. Collected
+# on flask.g, sent back as a Server-Timing header and logged as one JSON
+# line per request. Work done outside a request (background jobs) is not
+# attributed to any request.
+REQUEST_TIMING_LOG = os.getenv("REQUEST_TIMING_LOG", "1").lower() not in ("0", "false", "no")
+TIMING_CATEGORIES = ('db_pool', 'db', 'auth', 'storage')
+
+def record_timing(category, elapsed):
+    if has_request_context() and 'timings' in g:
+        entry = g.timings.setdefault(category, [0.0, 0])
+        entry[0] += elapsed
+        entry[1] += 1
+
+@contextmanager
+def timed(category):
+    """Suma la duración del bloque a una categoría de la petición actual."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(category, time.perf_counter() - started)
+
+class TimedCursorMixin:
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().execute(query, vars)
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            record_timing('db', elapsed)
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                record_slow_query(self, query, vars, elapsed, failed)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = super().executemany(query, vars_list)
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            record_timing('db', elapsed)
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                record_slow_query(self, query, None, elapsed, failed, explain=False)
+
+_timed_cursor_classes = {}
+
+def _timed_cursor_class(base):
+    cursor_class = _timed_cursor_classes.get(base)
+    if cursor_class is None:
+        cursor_class = type(f"Timed{base.__name__}", (TimedCursorMixin, base), {})
+        _timed_cursor_classes[base] = cursor_class
+    return cursor_class
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Conexión cuyos cursores (de cualquier cursor_factory) y commits se cronometran como 'db'."""
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _timed_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        with timed('db'):
+            return super().commit()
+
+    def rollback(self):
+        with timed('db'):
+            return super().rollback()
+
+class _TimedSupabaseService:
+    """Proxy de client.auth / client.storage: cada llamada a un método suma su duración a la categoría."""
+
+    def __init__(self, target, category):
+        self._target = target
+        self._category = category
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == 'admin':
+            return _TimedSupabaseService(attr, self._category)
+        if name == 'from_':
+            # Bucket selection is local; time the bucket's methods instead
+            return lambda *args, **kwargs: _TimedSupabaseService(attr(*args, **kwargs), self._category)
+        if not callable(attr):
+            return attr
+
+        def timed_call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with timed(self._category):
+                    return attr(*args, **kwargs)
+            finally:
+                SUPABASE_CALL_SECONDS.labels(service=self._category, method=name).observe(
+                    time.perf_counter() - started)
+        return timed_call
+
+class TimedSupabaseClient:
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def auth(self):
+        return _TimedSupabaseService(self._client.auth, 'auth')
+
+    @property
+    def storage(self):
+        return _TimedSupabaseService(self._client.storage, 'storage')
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    g.timings = {}
+
+@app.after_request
+def emit_request_timing(response):
+    if 'request_started' not in g:
+        return response
+    total = time.perf_counter() - g.request_started
+    timings = g.timings
+
+    server_timing = []
+    accounted = 0.0
+    for category in TIMING_CATEGORIES:
+        if category in timings:
+            elapsed, count = timings[category]
+            accounted += elapsed
+            server_timing.append(f'{category};dur={elapsed * 1000:.2f};desc="{count} calls"')
+    server_timing.append(f"app;dur={max(total - accounted, 0) * 1000:.2f}")
+    server_timing.append(f"total;dur={total * 1000:.2f}")
+    response.headers['Server-Timing'] = ", ".join(server_timing)
+
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUEST_SECONDS.labels(method=request.method, route=route).observe(total)
+    HTTP_REQUESTS_TOTAL.labels(method=request.method, route=route, status=str(response.status_code)).inc()
+    origin = request.headers.get('Origin')
+    if origin in origins_list:
+        response.headers['Timing-Allow-Origin'] = origin
+
+    if REQUEST_TIMING_LOG:
+        print(json.dumps({
+            "event": "request",
+            "ts": datetime.utcnow().isoformat(),
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "total_ms": round(total * 1000, 2),
+            "timings": {category: {"ms": round(elapsed * 1000, 2), "calls": count}
+                        for category, (elapsed, count) in timings.items()}
+        }))
+    return response
+
+# --- Readiness ---
+# The pool warms up in the background (see start_db_warmup), so the process
+# serves from the first second. Until it is ready, routes that need the
+# database get an immediate 503 with Retry-After instead of waiting on a
+# connection; probes, metrics, auth (Supabase only) and the buffered visit
+# counter stay available.
+DB_RETRY_AFTER_SECONDS = int(os.getenv("DB_RETRY_AFTER_SECONDS", "5"))
+NO_DB_ENDPOINTS = {
+    'root', 'health_check', 'api_health_check', 'debug_config', 'livez', 'readyz', 'metrics',
+    'record_property_visit', 'static',
+    # Supabase Auth only, or in-process state
+    'login', 'logout', 'refresh', 'get_upload_job'
+}
+
+@app.before_request
+def require_database_ready():
+    if request.method == 'OPTIONS' or request.endpoint is None or request.endpoint in NO_DB_ENDPOINTS:
+        return None
+    if db_ready():
+        return None
+    response = jsonify({"error": "Base de datos no disponible todavía, reintenta en unos segundos"})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(DB_RETRY_AFTER_SECONDS)
+    return response
+
+@app.route('/livez', methods=['GET'])
+def livez():
+    """Liveness: el proceso responde (no toca la base de datos)"""
+    return jsonify({"status": "ok", "pid": os.getpid()}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: el pool de este worker tiene conexiones a la base de datos"""
+    ready = db_ready()
+    body = {
+        "status": "ready" if ready else "starting",
+        "database": "connected" if ready else ("pool_not_initialized" if _db_pool is None else "connecting"),
+        "pid": os.getpid()
+    }
+    if _db_pool is not None:
+        stats = _db_pool.stats()
+        body["pool"] = {key: stats[key] for key in ('open', 'in_use', 'idle', 'connect_failures', 'reconnecting')}
+    response = jsonify(body)
+    if not ready:
+        response.status_code = 503
+        response.headers['Retry-After'] = str(DB_RETRY_AFTER_SECONDS)
+    return response
+
+# --- Slow Query Log ---
+# Statements slower than SLOW_QUERY_MS are aggregated per normalized SQL
+# (literals and placeholders replaced by ?, value lists collapsed) together
+# with the shape of their parameters, never the values. For SELECTs an
+# EXPLAIN (ANALYZE, BUFFERS) is sampled in the background, on another pooled
+# connection inside a READ ONLY transaction, at most once per statement per
+# SLOW_QUERY_EXPLAIN_INTERVAL. The log is per worker process.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0.2"))
+SLOW_QUERY_EXPLAIN_INTERVAL = int(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "600"))
+SLOW_QUERY_MAX_ENTRIES = int(os.getenv("SLOW_QUERY_MAX_ENTRIES", "200"))
+
+_slow_queries = {}
+_slow_queries_lock = threading.Lock()
+_explain_executor = None
+
+_SQL_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER_RE = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_SQL_PLACEHOLDER_RE = re.compile(r"%s|%\(\w+\)s|\$\d+")
+_SQL_VALUE_LIST_RE = re.compile(r"(\([?,\s]*\))(?:\s*,\s*\([?,\s]*\))+")
+_SQL_WRITE_RE = re.compile(r"\b(insert|update|delete|merge|truncate|alter|create|drop)\b", re.IGNORECASE)
+
+def normalize_sql(sql):
+    """SQL sin literales ni placeholders y con espacios colapsados, para agrupar sentencias equivalentes."""
+    sql = _SQL_STRING_RE.sub('?', sql)
+    sql = _SQL_PLACEHOLDER_RE.sub('?', sql)
+    sql = _SQL_NUMBER_RE.sub('?', sql)
+    sql = _SQL_VALUE_LIST_RE.sub(r"\1, ...", sql)
+    return " ".join(sql.split())[:4000]
+
+def params_shape(params):
+    """Tipos de los parámetros (no sus valores), p. ej. ['int', 'str', 'tuple[3]']."""
+    def shape(value):
+        if value is None:
+            return 'null'
+        if isinstance(value, (tuple, list)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return type(value).__name__
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: shape(value) for key, value in params.items()}
+    return [shape(value) for value in params]
+
+def _statement_sql(cursor, query):
+    if hasattr(query, 'as_string'):
+        query = query.as_string(cursor.connection)
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    # Prepared statements are logged (and explained) as their registered SQL
+    words = query.split(None, 2)
+    if len(words) >= 2 and words[0].upper() == 'EXECUTE' and words[1] in _registered_queries:
+        return _registered_queries[words[1]][0], True
+    return query, False
+
+def record_slow_query(cursor, query, params, elapsed, failed, explain=True):
+    try:
+        sql, prepared = _statement_sql(cursor, query)
+        normalized = normalize_sql(sql)
+        fingerprint = hashlib.sha1(normalized.encode()).hexdigest()[:16]
+        elapsed_ms = elapsed * 1000
+        now = time.time()
+        with _slow_queries_lock:
+            entry = _slow_queries.get(fingerprint)
+            if entry is None:
+                if len(_slow_queries) >= SLOW_QUERY_MAX_ENTRIES:
+                    del _slow_queries[min(_slow_queries, key=lambda key: _slow_queries[key]['max_ms'])]
+                entry = _slow_queries[fingerprint] = {
+                    "fingerprint": fingerprint, "sql": normalized, "calls": 0, "errors": 0,
+                    "total_ms": 0.0, "max_ms": 0.0, "explain": None, "explain_at": None
+                }
+            entry['calls'] += 1
+            entry['errors'] += int(failed)
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['last_ms'] = elapsed_ms
+            entry['last_seen'] = now
+            entry['params_shape'] = params_shape(params)
+            entry['endpoint'] = request.endpoint if has_request_context() else None
+            wants_explain = (
+                explain and not failed
+                and normalized.lower().startswith(('select', 'with'))
+                and not _SQL_WRITE_RE.search(normalized)
+                and (entry['explain_at'] is None or now - entry['explain_at'] > SLOW_QUERY_EXPLAIN_INTERVAL)
+                and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE
+            )
+            if wants_explain:
+                entry['explain_at'] = now
+        print(f"🐢 Consulta lenta ({elapsed_ms:.0f} ms{', prepared' if prepared else ''}): {normalized[:200]}")
+        if wants_explain:
+            global _explain_executor
+            if _explain_executor is None:
+                _explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+            _explain_executor.submit(_capture_explain, fingerprint, sql, params)
+    except Exception as e:
+        print(f"Error registrando consulta lenta: {e}")
+
+def _capture_explain(fingerprint, sql, params):
+    conn = None
+    try:
+        conn = get_db_connection()
+        # Plain cursor: the EXPLAIN itself must not land in the slow log
+        cursor = psycopg2.extensions.cursor(conn)
+        cursor.execute("SET TRANSACTION READ ONLY")
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+        cursor.close()
+        with _slow_queries_lock:
+            if fingerprint in _slow_queries:
+                _slow_queries[fingerprint]['explain'] = plan
+    except Exception as e:
+        print(f"Error capturando EXPLAIN: {e}")
+    finally:
+        if conn:
+            conn.rollback()
+            return_db_connection(conn)
+
+def get_slow_queries(limit=20, sort='max_ms'):
+    with _slow_queries_lock:
+        entries = [dict(entry) for entry in _slow_queries.values()]
+    entries.sort(key=lambda entry: entry[sort], reverse=True)
+    for entry in entries:
+        entry['avg_ms'] = round(entry['total_ms'] / entry['calls'], 2)
+        for key in ('total_ms', 'max_ms', 'last_ms'):
+            entry[key] = round(entry[key], 2)
+        for key in ('last_seen', 'explain_at'):
+            if entry[key]:
+                entry[key] = datetime.utcfromtimestamp(entry[key]).isoformat()
+    return entries[:limit]
+
 # --- GLOBALS - Initialize on startup ---
 _supabase_client = None
 _supabase_admin_client = None
 _db_pool = None
 
+# --- Database Pool ---
+# psycopg2's ThreadedConnectionPool raises PoolError as soon as every
+# connection is out and hands back sockets the Supabase session pooler may
+# already have closed. This pool queues callers up to DB_POOL_TIMEOUT
+# seconds, pings connections that sat idle, recycles old ones, and refills
+# itself in a background thread with exponential backoff.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "3"))  # bajo para Session Pooler
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PREPING_IDLE = float(os.getenv("DB_POOL_PREPING_IDLE", "30"))
+DB_POOL_RECONNECT_MAX_BACKOFF = 30
+
+class PoolTimeoutError(pool.PoolError):
+    pass
+
+class BoundedConnectionPool:
+    """Pool de conexiones con espera acotada, pre-ping, reciclado y reconexión en segundo plano."""
+
+    def __init__(self, minconn, maxconn, timeout=DB_POOL_TIMEOUT, recycle=DB_POOL_RECYCLE,
+                 preping_idle=DB_POOL_PREPING_IDLE, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.recycle = recycle
+        self.preping_idle = preping_idle
+        self._connect_kwargs = connect_kwargs
+        self._cond = threading.Condition()
+        self._idle = []            # [(conn, returned_at)], most recent last
+        self._created_at = {}      # id(conn) -> creation time
+        self._prepared = {}        # id(conn) -> names PREPAREd on that connection
+        self._open = 0             # connections open or being opened
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        self._reconnecting = False
+        self.ready = threading.Event()  # set once connections open, cleared on connect failures
+        self._stats = {"checkouts": 0, "timeouts": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+                       "recycled": 0, "ping_failures": 0, "connect_failures": 0}
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        self._created_at[id(conn)] = time.time()
+        self._prepared[id(conn)] = set()
+        return conn
+
+    def _close(self, conn):
+        self._created_at.pop(id(conn), None)
+        self._prepared.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def fill(self):
+        """Abre conexiones hasta minconn. Lanza la excepción de conexión si falla."""
+        while True:
+            with self._cond:
+                if self._closed or self._open >= self.minconn:
+                    if not self._closed:
+                        self.ready.set()
+                    return
+                self._open += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self.ready.clear()
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.time()))
+                self._cond.notify()
+
+    def start_reconnect(self):
+        """Rellena el pool en un hilo en segundo plano, con backoff exponencial entre intentos."""
+        with self._cond:
+            if self._reconnecting or self._closed:
+                return
+            self._reconnecting = True
+        threading.Thread(target=self._reconnect_loop, name="db-pool-reconnect", daemon=True).start()
+
+    def _reconnect_loop(self):
+        delay = 1
+        try:
+            while True:
+                try:
+                    self.fill()
+                    print(f"✅ Pool de base de datos listo (pid {os.getpid()})")
+                    return
+                except Exception as e:
+                    with self._cond:
+                        self._stats["connect_failures"] += 1
+                    if delay == 1:
+                        print(f"❌ Error conectando a PostgreSQL ({type(e).__name__}) en "
+                              f"{self._connect_kwargs.get('host')}:{self._connect_kwargs.get('port')}")
+                        print(f"⚠️  SOLUCIÓN: Verifica que uses Session Pooler, NO Transaction Pooler")
+                        print(f"⚠️  Si el problema persiste, considera el IPv4 Add-on ($4/mes)")
+                    print(f"⚠️  Reconexión a la base de datos fallida ({e}); reintento en {delay}s")
+                    time.sleep(delay)
+                    delay = min(delay * 2, DB_POOL_RECONNECT_MAX_BACKOFF)
+        finally:
+            with self._cond:
+                self._reconnecting = False
+
+    def _is_usable(self, conn, returned_at):
+        """Descarta conexiones cerradas o viejas y hace ping a las que llevan tiempo sin usarse."""
+        now = time.time()
+        if conn.closed:
+            return False
+        if self.recycle and now - self._created_at.get(id(conn), now) > self.recycle:
+            with self._cond:
+                self._stats["recycled"] += 1
+            return False
+        if now - returned_at > self.preping_idle:
+            try:
+                # Plain cursor/rollback: the ping is already part of the
+                # db_pool timing and must not be counted again as SQL time.
+                cursor = psycopg2.extensions.cursor(conn)
+                cursor.execute("SELECT 1")
+                cursor.close()
+                psycopg2.extensions.connection.rollback(conn)
+            except Exception:
+                with self._cond:
+                    self._stats["ping_failures"] += 1
+                return False
+        return True
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            conn = None
+            with self._cond:
+                self._waiting += 1
+                try:
+                    while not self._idle and self._open >= self.maxconn:
+                        if self._closed:
+                            raise pool.PoolError("connection pool is closed")
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats["timeouts"] += 1
+                            raise PoolTimeoutError(
+                                f"No database connection available after {timeout:.1f}s "
+                                f"({self._in_use}/{self.maxconn} in use)")
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                if self._closed:
+                    raise pool.PoolError("connection pool is closed")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                else:
+                    self._open += 1
+                self._in_use += 1
+
+            if conn is not None and not self._is_usable(conn, returned_at):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                try:
+                    conn = self._connect()
+                    self.ready.set()
+                except Exception:
+                    self.ready.clear()
+                    with self._cond:
+                        self._open -= 1
+                        self._in_use -= 1
+                        self._stats["connect_failures"] += 1
+                        self._cond.notify()
+                    self.start_reconnect()
+                    raise
+
+            waited_ms = (time.monotonic() - started) * 1000
+            with self._cond:
+                self._stats["checkouts"] += 1
+                self._stats["wait_ms_total"] += waited_ms
+                self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], waited_ms)
+            return conn
+
+    def putconn(self, conn, close=False):
+        if not close and not conn.closed:
+            try:
+                # Same cleanup as psycopg2's pool: never hand out a
+                # connection with an open transaction.
+                status = conn.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                close = True
+
+        with self._cond:
+            self._in_use -= 1
+            if close or conn.closed or self._closed:
+                self._open -= 1
+                refill = not self._closed and self._open < self.minconn
+            else:
+                self._idle.append((conn, time.time()))
+                refill = False
+            self._cond.notify()
+
+        if close or conn.closed or self._closed:
+            self._close(conn)
+        if refill:
+            self.start_reconnect()
+
+    def prepared_statements(self, conn):
+        """Nombres de sentencias ya preparadas en esta conexión (None si no es del pool)."""
+        return self._prepared.get(id(conn))
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            checkouts = self._stats["checkouts"]
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": checkouts,
+                "timeouts": self._stats["timeouts"],
+                "avg_wait_ms": round(self._stats["wait_ms_total"] / checkouts, 3) if checkouts else 0.0,
+                "max_wait_ms": round(self._stats["wait_ms_max"], 3),
+                "recycled": self._stats["recycled"],
+                "ping_failures": self._stats["ping_failures"],
+                "connect_failures": self._stats["connect_failures"],
+                "prepared_statements": sum(len(names) for names in self._prepared.values()),
+                "reconnecting": self._reconnecting
+            }
+
 # --- INITIALIZE CONNECTIONS ON STARTUP ---
 def init_connections():
     """Initialize all connections at startup instead of lazy loading"""
@@ -86,41 +743,43 @@ def init_connections():
         if not all([db_user, db_password, db_host, db_name]):
             raise ValueError(f"Faltan variables de entorno requeridas")
         
-        _db_pool = pool.ThreadedConnectionPool(
-            1,  # min connections
-            3,  # max connections (bajo para Session Pooler)
+        _db_pool = BoundedConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            connection_factory=InstrumentedConnection,
             user=db_user,
             password=db_password,
             host=db_host,
             port=db_port,
             dbname=db_name,
-            sslmode='require',
+            sslmode=os.getenv("DB_SSLMODE", "require"),
             connect_timeout=60,  # 60 segundos para Session Pooler
             options='-c statement_timeout=30000'  # 30 segundos por query
         )
-        print("✅ Database pool creado (1-3 conexiones)")
-        
-        # Test the connection
-        print("🔍 Probando conexión...")
-        test_conn = _db_pool.getconn()
-        cursor = test_conn.cursor()
-        cursor.execute("SELECT 1 as test")
-        result = cursor.fetchone()
-        cursor.close()
-        _db_pool.putconn(test_conn)
-        print(f"✅ Conexión a base de datos verificada (resultado: {result})")
-        
+        print(f"✅ Database pool creado ({DB_POOL_MIN}-{DB_POOL_MAX} conexiones, espera máx. {DB_POOL_TIMEOUT}s)")
     except Exception as e:
-        print(f"❌ ERROR CRÍTICO creando pool de base de datos:")
-        print(f"❌ Tipo de error: {type(e).__name__}")
-        print(f"❌ Mensaje: {str(e)}")
-        print(f"❌ Host: {os.getenv('HOST', '[NOT SET]')}")
-        print(f"❌ Port: {os.getenv('DB_PORT', '[NOT SET]')}")
+        print(f"❌ ERROR CRÍTICO creando pool de base de datos: {e}")
         print(f"⚠️  SOLUCIÓN: Verifica que uses Session Pooler, NO Transaction Pooler")
-        print(f"⚠️  Si el problema persiste, considera el IPv4 Add-on ($4/mes)")
-        import traceback
-        traceback.print_exc()
         _db_pool = None
+        return
+
+    # Under gunicorn with preload_app the master must not open connections
+    # (forked workers would share its sockets); each worker warms its own
+    # pool from the post_fork hook instead.
+    if os.getenv("DB_WARMUP_AFTER_FORK") != "1":
+        start_db_warmup()
+
+def start_db_warmup():
+    """
+    Abre las conexiones mínimas del pool en segundo plano, reintentando con backoff.
+    El proceso atiende peticiones de inmediato; /readyz indica cuándo hay base de datos.
+    """
+    if _db_pool is not None:
+        print(f"🔍 Conectando a la base de datos en segundo plano (pid {os.getpid()})...")
+        _db_pool.start_reconnect()
+
+def db_ready():
+    return _db_pool is not None and _db_pool.ready.is_set()
 
 # Initialize connections when app starts
 init_connections()
@@ -129,31 +788,40 @@ def get_supabase_client():
     """Get Supabase client"""
     if _supabase_client is None:
         raise ValueError("Supabase client not initialized")
-    return _supabase_client
+    return TimedSupabaseClient(_supabase_client)
 
 def get_supabase_admin():
     """Get Supabase admin client"""
     if _supabase_admin_client is None:
         raise ValueError("Supabase admin client not initialized")
-    return _supabase_admin_client
+    return TimedSupabaseClient(_supabase_admin_client)
 
 def get_db_connection():
     """Get a connection from the pool"""
     if _db_pool is None:
         raise ValueError("Database pool not initialized")
     
+    started = time.perf_counter()
     try:
-        conn = _db_pool.getconn()
+        with timed('db_pool'):
+            conn = _db_pool.getconn()
+        DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+        report_pool_metrics()
         return conn
+    except PoolTimeoutError as e:
+        DB_POOL_TIMEOUTS_TOTAL.inc()
+        print(f"Error obteniendo conexión del pool: {e}")
+        raise
     except Exception as e:
         print(f"Error obteniendo conexión del pool: {e}")
         raise
 
-def return_db_connection(conn):
-    """Return connection to the pool"""
+def return_db_connection(conn, close=False):
+    """Return connection to the pool (close=True discards it, e.g. after a broken socket)"""
     try:
         if _db_pool and conn:
-            _db_pool.putconn(conn)
+            _db_pool.putconn(conn, close=close)
+            report_pool_metrics()
     except Exception as e:
         print(f"Error retornando conexión al pool: {e}")
         if conn:
@@ -162,6 +830,66 @@ def return_db_connection(conn):
             except:
                 pass
 
+# --- Prepared Statements ---
+# Hot queries are registered once by name and run through PREPARE/EXECUTE so
+# Postgres plans them once per pooled connection. The pool tracks which
+# names each connection has prepared; a reconnected connection starts empty
+# and re-prepares on first use. If the server session lost its statements
+# (pooler switched backends, DISCARD ALL) the set is cleared and the query is
+# prepared again. Session-level PREPARE is not guaranteed behind a
+# transaction-mode pooler, so the feature defaults off on Supabase's
+# transaction pooler port (6543); DB_PREPARED_STATEMENTS=1/0 forces it.
+TRANSACTION_POOLER_PORT = "6543"
+USE_PREPARED_STATEMENTS = os.getenv(
+    "DB_PREPARED_STATEMENTS",
+    "0" if os.getenv("DB_PORT", TRANSACTION_POOLER_PORT) == TRANSACTION_POOLER_PORT else "1"
+).lower() not in ("0", "false", "no")
+
+_registered_queries = {}
+
+def register_query(name, sql):
+    """Registra una consulta con placeholders %s para ejecutarla como sentencia preparada. Devuelve el nombre."""
+    sql = sql.strip().rstrip(';')
+    parts = sql.split('%s')
+    prepared_sql = parts[0] + ''.join(f"${number}{part}" for number, part in enumerate(parts[1:], start=1))
+    _registered_queries[name] = (sql, prepared_sql.replace('%%', '%'), len(parts) - 1)
+    return name
+
+def execute_prepared(cursor, name, params=()):
+    """Ejecuta una consulta registrada con EXECUTE, preparándola antes si esta conexión aún no la tiene."""
+    sql, prepared_sql, param_count = _registered_queries[name]
+    prepared = _db_pool.prepared_statements(cursor.connection) if USE_PREPARED_STATEMENTS and _db_pool else None
+    if prepared is None:
+        cursor.execute(sql, params)
+        return
+
+    conn = cursor.connection
+    in_transaction = conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    try:
+        _execute_prepared(cursor, name, prepared_sql, param_count, params, prepared)
+    except (InvalidSqlStatementName, DuplicatePreparedStatement) as e:
+        # La sesión del servidor no coincide con lo registrado (cambio de
+        # backend en el pooler, DISCARD ALL): se resincroniza el set.
+        if isinstance(e, DuplicatePreparedStatement):
+            prepared.add(name)
+        else:
+            prepared.clear()
+        if in_transaction:
+            # Reintentar tras un rollback perdería el trabajo previo de la transacción.
+            raise
+        print(f"⚠️  Sentencia preparada {name} desincronizada con el servidor ({type(e).__name__}); reintentando")
+        conn.rollback()
+        _execute_prepared(cursor, name, prepared_sql, param_count, params, prepared)
+
+def _execute_prepared(cursor, name, prepared_sql, param_count, params, prepared):
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {prepared_sql}")
+        prepared.add(name)
+    if param_count:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * param_count)})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
 # Storage Configuration
 BUCKET_NAME = "imagenes casas"
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
@@ -169,36 +897,400 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# --- Helper Functions ---
-def get_user_id_from_token(request):
-    """Extrae el user ID del token de autorización."""
+# Uploads are spooled to disk in chunks and streamed to storage from the
+# temp file, so a large photo never sits in worker memory as one bytes object.
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_MB", "15")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 256 * 1024
+IMAGE_UPLOAD_WORKERS = int(os.getenv("IMAGE_UPLOAD_WORKERS", "2"))
+IMAGE_BATCH_CONCURRENCY = int(os.getenv("IMAGE_BATCH_CONCURRENCY", "6"))
+IMAGE_BATCH_MAX_FILES = int(os.getenv("IMAGE_BATCH_MAX_FILES", "50"))
+UPLOAD_JOB_TTL = int(os.getenv("UPLOAD_JOB_TTL", "3600"))
+
+class UploadTooLargeError(Exception):
+    pass
+
+def spool_upload(file_storage, max_bytes=MAX_IMAGE_BYTES):
+    """Copia el archivo subido a un temporal en disco por bloques. Devuelve la ruta del temporal."""
+    fd, tmp_path = tempfile.mkstemp(prefix='casita_upload_')
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"File exceeds the {max_bytes // (1024 * 1024)} MB limit")
+                out.write(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+def upload_file_to_storage(file_path, local_path, content_type):
+    """Sube un archivo local al bucket en streaming (httpx lo envía por bloques). Devuelve la URL pública."""
+    storage = get_supabase_client().storage.from_(BUCKET_NAME)
+    with open(local_path, 'rb') as fh:
+        storage.upload(file_path, fh, file_options={"content-type": content_type})
+    return storage.get_public_url(file_path)
+
+_upload_executor = None
+_upload_executor_lock = threading.Lock()
+_storage_executor = None
+_upload_jobs = {}
+_upload_jobs_lock = threading.Lock()
+
+def get_upload_executor():
+    """Executor de subidas en segundo plano (se crea en el worker al primer uso)."""
+    global _upload_executor
+    with _upload_executor_lock:
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(
+                max_workers=IMAGE_UPLOAD_WORKERS,
+                thread_name_prefix='image-upload'
+            )
+        return _upload_executor
+
+def get_storage_executor():
+    """Pool acotado para transferencias concurrentes a Storage dentro de una petición (batch)."""
+    global _storage_executor
+    with _upload_executor_lock:
+        if _storage_executor is None:
+            _storage_executor = ThreadPoolExecutor(
+                max_workers=IMAGE_BATCH_CONCURRENCY,
+                thread_name_prefix='storage-transfer'
+            )
+        return _storage_executor
+
+def _prune_upload_jobs():
+    cutoff = time.time() - UPLOAD_JOB_TTL
+    for job_id, job in list(_upload_jobs.items()):
+        if job['status'] in ('done', 'error') and job['finished_ts'] < cutoff:
+            del _upload_jobs[job_id]
+
+def _update_upload_job(job_id, **fields):
+    with _upload_jobs_lock:
+        _upload_jobs[job_id].update(fields)
+
+def submit_upload_job(fn, *args):
+    """Ejecuta fn(*args) en segundo plano y devuelve el id del job para consultar su estado."""
+    job_id = uuid.uuid4().hex
+    with _upload_jobs_lock:
+        _prune_upload_jobs()
+        _upload_jobs[job_id] = {
+            "id": job_id,
+            "status": "pending",
+            "result": None,
+            "error": None,
+            "created_at": datetime.utcnow().isoformat(),
+            "finished_ts": None
+        }
+
+    def run():
+        _update_upload_job(job_id, status="running")
+        try:
+            result = fn(*args)
+            _update_upload_job(job_id, status="done", result=result, finished_ts=time.time())
+        except Exception as e:
+            print(f"Error en job de subida {job_id}: {e}")
+            _update_upload_job(job_id, status="error", error=str(e), finished_ts=time.time())
+
+    get_upload_executor().submit(run)
+    return job_id
+
+# --- Image Derivatives ---
+# Resized copies (JPEG + WebP) are stored next to the original in the bucket
+# and recorded in propiedades_imagenes.variantes, so list views can load a
+# small card image instead of the full-size upload.
+IMAGE_DERIVATIVES_ENABLED = os.getenv("IMAGE_DERIVATIVES_ENABLED", "true").lower() == "true"
+IMAGE_DERIVATIVE_SIZES = {'thumb': 320, 'medium': 1024}
+IMAGE_DERIVATIVE_FORMATS = (
+    ('', 'JPEG', 'jpg', 'image/jpeg'),
+    ('_webp', 'WEBP', 'webp', 'image/webp'),
+)
+IMAGE_DERIVATIVE_QUALITY = int(os.getenv("IMAGE_DERIVATIVE_QUALITY", "82"))
+
+def derivative_file_paths(nombre_archivo):
+    """Rutas en el bucket de todas las variantes de una imagen, por nombre de variante."""
+    stem = nombre_archivo.rsplit('.', 1)[0]
+    return {
+        f"{variant}{suffix}": f"propiedades/{stem}_{variant}.{ext}"
+        for variant in IMAGE_DERIVATIVE_SIZES
+        for suffix, _, ext, _ in IMAGE_DERIVATIVE_FORMATS
+    }
+
+def generate_image_derivatives(imagen_id, nombre_archivo, local_path):
+    """Genera y sube las variantes de una imagen y las guarda en propiedades_imagenes.variantes."""
+    storage = get_supabase_client().storage.from_(BUCKET_NAME)
+    paths = derivative_file_paths(nombre_archivo)
+    variantes = {}
+
+    # Only one reduced copy is kept: JPEGs are decoded at a reduced DCT scale
+    # (draft) close to the largest variant, and each smaller variant is
+    # resized from the previous one instead of from the original.
+    largest = max(IMAGE_DERIVATIVE_SIZES.values())
+    with Image.open(local_path) as img:
+        img.seek(0)
+        img.draft('RGB', (largest, largest))
+        # Palette/bilevel images would be resized with NEAREST
+        source = img.convert('RGBA') if img.mode in ('1', 'P') else img
+        source.thumbnail((largest, largest), Image.LANCZOS)
+        resized = ImageOps.exif_transpose(source).convert('RGBA')
+
+    for variant, max_side in sorted(IMAGE_DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+        resized.thumbnail((max_side, max_side), Image.LANCZOS)
+        flat = Image.new('RGB', resized.size, (255, 255, 255))
+        flat.paste(resized, mask=resized.getchannel('A'))
+
+        for suffix, image_format, _, content_type in IMAGE_DERIVATIVE_FORMATS:
+            buffer = io.BytesIO()
+            source = flat if image_format == 'JPEG' else resized
+            source.save(buffer, image_format, quality=IMAGE_DERIVATIVE_QUALITY)
+            name = f"{variant}{suffix}"
+            storage.upload(paths[name], buffer.getvalue(), file_options={"content-type": content_type, "upsert": "true"})
+            variantes[name] = storage.get_public_url(paths[name])
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE propiedades_imagenes SET variantes = %s WHERE id = %s;",
+            (Json(variantes), imagen_id)
+        )
+        conn.commit()
+        cursor.close()
+    except Exception:
+        if conn: conn.rollback()
+        raise
+    finally:
+        if conn:
+            return_db_connection(conn)
+    return variantes
+
+def schedule_image_derivatives(imagen_id, nombre_archivo, local_path):
+    """
+    Encola la generación de variantes en segundo plano. Si se encola, el job
+    se queda con el temporal y lo borra al terminar (devuelve True).
+    """
+    if not IMAGE_DERIVATIVES_ENABLED:
+        return False
+
+    def run():
+        try:
+            generate_image_derivatives(imagen_id, nombre_archivo, local_path)
+        except Exception as e:
+            print(f"Error generando variantes de la imagen {imagen_id}: {e}")
+        finally:
+            try:
+                os.remove(local_path)
+            except OSError:
+                pass
+
+    get_upload_executor().submit(run)
+    return True
+
+# --- Caches ---
+class ExpiringLRUCache:
+    """LRU acotado y thread-safe cuyas entradas caducan en un instante absoluto (epoch)."""
+
+    def __init__(self, maxsize, name=None):
+        self.maxsize = maxsize
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self._get(key)
+        if self.name:
+            CACHE_REQUESTS_TOTAL.labels(cache=self.name, result='miss' if value is None else 'hit').inc()
+        return value
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at):
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        return {"size": size, "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+# --- Token Verification ---
+# Supabase access tokens are JWTs: they are verified locally (signature, exp,
+# aud) and remembered until they expire, so authenticated endpoints do not pay
+# a round trip to Supabase Auth on every request.
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+SUPABASE_JWKS_URL = os.getenv(
+    "SUPABASE_JWKS_URL",
+    f"{os.getenv('SUPABASE_URL', 'https://izozjytmktbuhpttczid.supabase.co')}/auth/v1/.well-known/jwks.json"
+)
+JWT_LEEWAY_SECONDS = int(os.getenv("JWT_LEEWAY_SECONDS", "10"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+
+_verified_tokens = ExpiringLRUCache(TOKEN_CACHE_SIZE, name='verified_tokens')
+_jwks_client = None
+
+def get_jwks_client():
+    """Cliente JWKS (claves asimétricas de Supabase). Las claves se cachean tras la primera descarga."""
+    global _jwks_client
+    if _jwks_client is None:
+        _jwks_client = jwt.PyJWKClient(SUPABASE_JWKS_URL, cache_keys=True)
+    return _jwks_client
+
+def _token_cache_key(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def get_bearer_token(request):
+    """Extrae el token Bearer de la cabecera Authorization."""
     auth_header = request.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
         raise Exception("No token provided")
-    token = auth_header.split(' ')[1]
+    return auth_header.split(' ')[1]
+
+def _decode_token_locally(token):
+    """Verifica firma, exp y aud sin salir del proceso. Devuelve None si no hay clave local disponible."""
+    header = jwt.get_unverified_header(token)
+    algorithm = header.get('alg')
+
+    if algorithm == 'HS256':
+        if not SUPABASE_JWT_SECRET:
+            return None
+        key = SUPABASE_JWT_SECRET
+    elif algorithm in ('RS256', 'ES256'):
+        try:
+            with timed('auth'):
+                key = get_jwks_client().get_signing_key_from_jwt(token).key
+        except jwt.PyJWKClientConnectionError as e:
+            print(f"JWKS no disponible, verificando token contra Supabase: {e}")
+            return None
+    else:
+        raise jwt.InvalidAlgorithmError(f"Unsupported token algorithm: {algorithm}")
+
+    return jwt.decode(
+        token,
+        key,
+        algorithms=[algorithm],
+        audience=SUPABASE_JWT_AUDIENCE,
+        leeway=JWT_LEEWAY_SECONDS,
+        options={"require": ["exp", "sub"]}
+    )
+
+def _verify_token_remotely(token):
+    """Valida el token contra Supabase Auth (detecta sesiones revocadas)."""
     user_response = get_supabase_client().auth.get_user(token)
     if not user_response or not user_response.user:
         raise Exception("Invalid token")
-    return user_response.user.id
+    user = user_response.user
+    claims = jwt.decode(token, options={"verify_signature": False})
+    claims['sub'] = user.id
+    claims['email'] = user.email
+    return claims
+
+def verify_access_token(token, verify_remote=False):
+    """
+    Devuelve los claims de un access token válido o lanza "Invalid token".
+    Con verify_remote=True se consulta siempre a Supabase Auth (para endpoints sensibles a revocación).
+    """
+    cache_key = _token_cache_key(token)
+
+    if not verify_remote:
+        claims = _verified_tokens.get(cache_key)
+        if claims is not None:
+            return claims
+
+    try:
+        claims = None if verify_remote else _decode_token_locally(token)
+        if claims is None:
+            claims = _verify_token_remotely(token)
+    except jwt.PyJWTError as e:
+        raise Exception(f"Invalid token: {e}")
+
+    _verified_tokens.set(cache_key, claims, claims['exp'])
+    return claims
+
+# --- Helper Functions ---
+def get_user_id_from_token(request, verify_remote=False):
+    """Extrae el user ID del token de autorización."""
+    token = get_bearer_token(request)
+    return verify_access_token(token, verify_remote=verify_remote)['sub']
+
+# --- Role Cache ---
+# Roles change only through the admin/register endpoints below, which
+# invalidate entries explicitly; the TTL bounds staleness across workers.
+ROLE_CACHE_TTL = int(os.getenv("ROLE_CACHE_TTL", "60"))
+ROLE_CACHE_SIZE = int(os.getenv("ROLE_CACHE_SIZE", "1024"))
+_NO_PROFILE = ''
+
+_role_cache = ExpiringLRUCache(ROLE_CACHE_SIZE, name='user_roles')
+
+USER_ROLE_QUERY = register_query('user_role', "SELECT role FROM public.profiles WHERE id = %s")
+
+def get_user_role(user_id):
+    """Devuelve el rol del usuario (None si no tiene perfil), usando la caché de roles."""
+    key = str(user_id)
+    cached = _role_cache.get(key)
+    if cached is not None:
+        return cached or None
 
-def is_admin(user_id: str) -> bool:
     conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT role FROM public.profiles WHERE id = %s", (user_id,))
+        execute_prepared(cursor, USER_ROLE_QUERY, (user_id,))
         profile = cursor.fetchone()
         cursor.close()
-        if profile and profile['role'] == 'admin':
-            return True
-        return False
-    except Exception as e:
-        print(f"Error checking admin role: {e}")
-        return False
     finally:
         if conn:
             return_db_connection(conn)
 
+    role = profile['role'] if profile else _NO_PROFILE
+    _role_cache.set(key, role, time.time() + ROLE_CACHE_TTL)
+    return role or None
+
+def invalidate_user_role(user_id):
+    """Descarta el rol cacheado de un usuario tras cambiarlo."""
+    _role_cache.invalidate(str(user_id))
+
+def is_admin(user_id: str) -> bool:
+    try:
+        return get_user_role(user_id) == 'admin'
+    except Exception as e:
+        print(f"Error checking admin role: {e}")
+        return False
+
 # --- Health Check Endpoints ---
 @app.route('/', methods=['GET'])
 def root():
@@ -231,10 +1323,16 @@ def api_health_check():
     
     db_status = "not_initialized"
     db_error = None
+    status = "ok"
     
     if _db_pool is None:
         db_status = "pool_not_initialized"
         db_error = "Database pool was not created during startup. Check logs for initialization errors."
+    elif not db_ready():
+        # Warm-up in progress: answer now instead of connecting inline (see /readyz)
+        status = "degraded"
+        db_status = "connecting"
+        db_error = "Database pool is still warming up"
     else:
         conn = None
         try:
@@ -251,7 +1349,7 @@ def api_health_check():
                 return_db_connection(conn)
     
     response = {
-        "status": "ok",
+        "status": status,
         "database": db_status,
         "supabase_url": os.getenv("SUPABASE_URL", "https://izozjytmktbuhpttczid.supabase.co"),
         "cors_origins": origins_list,
@@ -276,10 +1374,14 @@ def debug_config():
             "SUPABASE_URL": "✅ Configured" if os.getenv("SUPABASE_URL") else "❌ Missing",
             "SUPABASE_ANON_KEY": "✅ Configured" if os.getenv("SUPABASE_ANON_KEY") else "❌ Missing",
             "SUPABASE_SERVICE_KEY": "✅ Configured" if os.getenv("SUPABASE_SERVICE_KEY") else "❌ Missing",
+            "SUPABASE_JWT_SECRET": "✅ Configured" if os.getenv("SUPABASE_JWT_SECRET") else "❌ Missing (using JWKS / remote verification)",
             "CORS_ORIGINS": os.getenv("CORS_ORIGINS", "❌ Missing"),
         },
         "database_pool_status": "initialized" if _db_pool else "not_initialized",
+        "database_pool": _db_pool.stats() if _db_pool else None,
         "supabase_client_status": "initialized" if _supabase_client else "not_initialized",
+        "token_cache": _verified_tokens.stats(),
+        "role_cache": _role_cache.stats(),
         "timestamp": datetime.utcnow().isoformat()
     }), 200
 
@@ -312,6 +1414,7 @@ def register():
                 )
                 conn.commit()
                 cursor.close()
+                invalidate_user_role(new_user_id)
             except Exception as db_error:
                 print(f"Error setting profile role during registration for {new_user_id}: {db_error}")
             finally:
@@ -369,6 +1472,7 @@ def logout():
             token = auth_header.split(' ')[1]
 
         if token:
+            _verified_tokens.invalidate(_token_cache_key(token))
             get_supabase_client().auth.sign_out(token)
         else:
             get_supabase_client().auth.sign_out()
@@ -389,28 +1493,18 @@ def get_user():
             return jsonify({"error": "No token provided"}), 401
 
         token = auth_header.split(' ')[1]
-        user_response = get_supabase_client().auth.get_user(token)
-        user = user_response.user
+        claims = verify_access_token(token)
+        user_id = claims['sub']
 
         role = 'user'
-        conn = None
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute("SELECT role FROM public.profiles WHERE id = %s", (user.id,))
-            profile = cursor.fetchone()
-            cursor.close()
-            if profile:
-                role = profile['role']
+            role = get_user_role(user_id) or 'user'
         except Exception as db_error:
-            print(f"Error fetching role for user {user.id}: {db_error}")
-        finally:
-            if conn:
-                return_db_connection(conn)
+            print(f"Error fetching role for user {user_id}: {db_error}")
 
         return jsonify({
-            "id": user.id,
-            "email": user.email,
+            "id": user_id,
+            "email": claims.get('email'),
             "role": role
         }), 200
 
@@ -486,6 +1580,434 @@ def get_catalogos():
             return_db_connection(conn)
 
 # --- Properties Endpoints ---
+# Listing pages are keyed on p.id (keyset pagination): each page seeks straight
+# to "id < cursor" on the primary key, so deep pages cost the same as the first.
+PROPERTIES_DEFAULT_PAGE_SIZE = int(os.getenv("PROPERTIES_PAGE_SIZE", "50"))
+PROPERTIES_MAX_PAGE_SIZE = int(os.getenv("PROPERTIES_MAX_PAGE_SIZE", "200"))
+
+# Images are aggregated per row through a LATERAL subquery instead of a
+# join + GROUP BY, so only the properties on the current page pay for it.
+PROPERTY_IMAGES_LATERAL_SQL = """
+    LEFT JOIN LATERAL (
+        SELECT json_agg(
+                   json_build_object(
+                       'id', pi.id,
+                       'url', pi.url,
+                       'nombre_archivo', pi.nombre_archivo,
+                       'es_principal', pi.es_principal,
+                       'orden', pi.orden,
+                       'variantes', pi.variantes
+                   ) ORDER BY pi.orden ASC
+               ) AS imagenes
+        FROM propiedades_imagenes pi
+        WHERE pi.propiedad_id = p.id
+    ) imgs ON TRUE
+"""
+
+# Writable columns of propiedades, in the order used by INSERTs
+PROPERTY_COLUMNS = (
+    'titulo', 'descripcion', 'precio', 'precio_alquiler', 'valor_administracion',
+    'habitaciones', 'alcobas', 'banos', 'banos_medios', 'estacionamientos',
+    'anio_construccion', 'piso', 'm2_terreno', 'm2_construccion', 'm2_privada',
+    'direccion', 'codigo_postal', 'lat', 'lng', 'registro_publico',
+    'convenio_url', 'convenio_validado',
+    'tipo_negocio_id', 'tipo_propiedad_id', 'estado_publicacion_id',
+    'captado_por_agente_id', 'moneda_id', 'frecuencia_alquiler_id',
+    'estado_fisico_id', 'estado_id', 'ciudad_id', 'zona_id', 'agente_id',
+    'agente_externo_id', 'validado_por_usuario_id'
+)
+PROPERTY_INSERT_DEFAULTS = {
+    'habitaciones': 0, 'alcobas': 0, 'banos': 0, 'banos_medios': 0, 'estacionamientos': 0,
+    'm2_terreno': 0, 'm2_construccion': 0, 'm2_privada': 0, 'convenio_validado': False
+}
+PROPERTY_DECIMAL_COLUMNS = {
+    'precio', 'precio_alquiler', 'valor_administracion',
+    'm2_terreno', 'm2_construccion', 'm2_privada', 'lat', 'lng'
+}
+PROPERTY_INTEGER_COLUMNS = {
+    'habitaciones', 'alcobas', 'banos', 'banos_medios', 'estacionamientos', 'anio_construccion'
+} | {column for column in PROPERTY_COLUMNS if column.endswith('_id')}
+PROPERTY_BOOLEAN_COLUMNS = {'convenio_validado'}
+
+# Foreign keys that may also be given by catalog name (e.g. "ciudad": "Zapopan")
+PROPERTY_CATALOG_COLUMNS = {
+    'tipo_negocio_id': 'tipos_negocio',
+    'tipo_propiedad_id': 'tipos_propiedad',
+    'estado_publicacion_id': 'estados_publicacion',
+    'captado_por_agente_id': 'agentes',
+    'moneda_id': 'monedas',
+    'frecuencia_alquiler_id': 'frecuencias_alquiler',
+    'estado_fisico_id': 'estados_fisicos',
+    'estado_id': 'estados',
+    'ciudad_id': 'ciudades',
+    'zona_id': 'zonas',
+    'agente_id': 'agentes',
+    'agente_externo_id': 'agentes_externos'
+}
+
+# Columns returned by the read endpoints. Listed explicitly (not p.*) so
+# internal columns such as search_vector never reach API responses.
+PROPERTY_READ_COLUMNS = ('id',) + PROPERTY_COLUMNS + (
+    'visitas', 'fecha_validacion', 'created_at', 'updated_at', 'deleted_at'
+)
+PROPERTY_SELECT_SQL = ", ".join(f"p.{column}" for column in PROPERTY_READ_COLUMNS)
+
+# Sparse fieldsets (?fields=titulo,precio,imagenes or ?fields=card). Names are
+# checked against PROPERTY_READ_COLUMNS; "id" is always returned because the
+# pagination cursor is built from it.
+PROPERTY_PRINCIPAL_IMAGE_LATERAL_SQL = """
+    LEFT JOIN LATERAL (
+        SELECT json_build_object(
+                   'id', pi.id,
+                   'url', pi.url,
+                   'nombre_archivo', pi.nombre_archivo,
+                   'variantes', pi.variantes
+               ) AS imagen_principal
+        FROM propiedades_imagenes pi
+        WHERE pi.propiedad_id = p.id
+        ORDER BY pi.es_principal DESC, pi.orden ASC
+        LIMIT 1
+    ) img_principal ON TRUE
+"""
+PROPERTY_CARD_COLUMNS = (
+    'id', 'titulo', 'precio', 'precio_alquiler', 'moneda_id', 'frecuencia_alquiler_id',
+    'tipo_negocio_id', 'tipo_propiedad_id', 'estado_publicacion_id',
+    'habitaciones', 'banos', 'estacionamientos', 'm2_construccion',
+    'ciudad_id', 'zona_id', 'lat', 'lng'
+)
+PROPERTY_IMAGE_FIELDS = ('imagenes', 'imagen_principal')
+
+def parse_property_fields(raw):
+    """
+    Interpreta ?fields=. Devuelve (columnas, imagenes) donde imagenes es
+    'imagenes', 'imagen_principal' o None. Lanza ValueError con campos desconocidos.
+    """
+    if not raw:
+        return PROPERTY_READ_COLUMNS, 'imagenes'
+    if raw == 'card':
+        return PROPERTY_CARD_COLUMNS, 'imagen_principal'
+
+    requested = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in requested
+               if field not in PROPERTY_READ_COLUMNS and field not in PROPERTY_IMAGE_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+
+    columns = ('id',) + tuple(field for field in PROPERTY_READ_COLUMNS
+                              if field in requested and field != 'id')
+    images = next((field for field in PROPERTY_IMAGE_FIELDS if field in requested), None)
+    return columns, images
+
+def property_projection_sql(fields):
+    """(select_sql, join_sql) para la proyección devuelta por parse_property_fields."""
+    columns, images = fields
+    select_sql = ", ".join(f"p.{column}" for column in columns)
+    if images == 'imagenes':
+        return select_sql + ", imgs.imagenes", PROPERTY_IMAGES_LATERAL_SQL
+    if images == 'imagen_principal':
+        return select_sql + ", img_principal.imagen_principal", PROPERTY_PRINCIPAL_IMAGE_LATERAL_SQL
+    return select_sql, ""
+
+# Full-text search runs against the generated propiedades.search_vector column
+# (GIN index, Spanish stemming + unaccent; see migrations/003). Every term is
+# matched as a prefix so partial words work for type-ahead.
+SEARCH_TS_CONFIG = "public.spanish_unaccent"
+SEARCH_MAX_TERMS = 8
+
+def build_search_tsquery(q):
+    """Convierte el texto de búsqueda en un tsquery de prefijos ('casa:* & playa:*'), o None si no hay términos."""
+    terms = re.findall(r'\w+', q, re.UNICODE)[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return ' & '.join(f"{term}:*" for term in terms)
+
+# Geospatial filters use a GiST index on point(lng, lat) (migrations/004):
+# bbox is a direct "point <@ box" lookup; radius search prefilters with the
+# enclosing box and then applies the exact haversine distance.
+GEO_POINT_SQL = "point(p.lng::float8, p.lat::float8)"
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.32
+GEO_DEFAULT_RADIUS_KM = float(os.getenv("GEO_DEFAULT_RADIUS_KM", "5"))
+GEO_MAX_RADIUS_KM = float(os.getenv("GEO_MAX_RADIUS_KM", "200"))
+GEO_DISTANCE_SQL = (
+    f"(2 * {EARTH_RADIUS_KM} * asin(sqrt(least(1.0,"
+    " power(sin(radians(p.lat::float8 - geo_center.lat) / 2), 2)"
+    " + cos(radians(geo_center.lat)) * cos(radians(p.lat::float8))"
+    " * power(sin(radians(p.lng::float8 - geo_center.lng) / 2), 2)))))"
+)
+
+def parse_bbox(value):
+    """'minLng,minLat,maxLng,maxLat' -> tupla de floats. Lanza ValueError si es inválido."""
+    parts = [float(part) for part in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError("bbox must be 'minLng,minLat,maxLng,maxLat'")
+    min_lng, min_lat, max_lng, max_lat = parts
+    if min_lng > max_lng or min_lat > max_lat:
+        raise ValueError("bbox min values must not exceed max values")
+    return min_lng, min_lat, max_lng, max_lat
+
+def radius_bbox(lat, lng, radius_km):
+    """Caja que contiene el círculo de radio radius_km alrededor de (lat, lng)."""
+    delta_lat = radius_km / KM_PER_DEGREE_LAT
+    delta_lng = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return lng - delta_lng, lat - delta_lat, lng + delta_lng, lat + delta_lat
+
+# Each property stores the geohash of its coordinates (written by every
+# insert/update path); map clusters group on a geohash prefix whose length
+# follows the zoom level.
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    """Geohash estándar (base32) de una coordenada."""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value_range, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            value_range[0] = mid
+        else:
+            bits = bits * 2
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+def property_geohash(lat, lng):
+    """Geohash de una propiedad, o None si no tiene coordenadas válidas."""
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return encode_geohash(lat, lng)
+
+# Facet filters: multi-value ids (?ciudad_id=1,2) and numeric ranges
+# (?precio_min=&precio_max=). They are kept apart from the other filters so
+# each facet's counts can be computed with every filter except its own.
+FACET_MULTI_VALUE_COLUMNS = ('ciudad_id', 'zona_id', 'tipo_propiedad_id', 'moneda_id')
+FACET_RANGE_COLUMNS = ('precio', 'habitaciones', 'banos')
+FACET_COUNT_COLUMNS = FACET_MULTI_VALUE_COLUMNS + ('habitaciones', 'banos')
+
+def search_where(search, exclude=None):
+    """Condiciones y parámetros de una búsqueda, opcionalmente sin el filtro de una faceta."""
+    filters = list(search['filters'])
+    params = list(search['params'])
+    for facet, (condition, facet_params) in search['facet_filters'].items():
+        if facet != exclude:
+            filters.append(condition)
+            params.extend(facet_params)
+    return filters, params
+
+def build_property_search(args):
+    """
+    Traduce los filtros de la petición a piezas SQL sobre "propiedades p":
+    joins extra (from_sql/from_params), condiciones (filters/params) y,
+    si el orden no es por id, la expresión de orden (sort_sql, sort_desc).
+    sort_alias indica si la clave de orden se devuelve en cada fila.
+    Lanza ValueError si algún filtro es inválido.
+    """
+    search = {
+        "from_sql": "",
+        "from_params": [],
+        "filters": ["p.deleted_at IS NULL"],
+        "params": [],
+        "sort_sql": None,
+        "sort_desc": True,
+        "sort_alias": None,
+        "facet_filters": {}
+    }
+
+    tipo_negocio_id = args.get('tipo_negocio_id')
+    if tipo_negocio_id:
+        search['filters'].append("p.tipo_negocio_id = %s")
+        search['params'].append(tipo_negocio_id)
+
+    estado_publicacion_id_not_in_str = args.get('estado_publicacion_id__not_in')
+    if estado_publicacion_id_not_in_str:
+        try:
+            excluded_ids = tuple(int(id) for id in estado_publicacion_id_not_in_str.split(','))
+            if excluded_ids:
+                search['filters'].append("p.estado_publicacion_id NOT IN %s")
+                search['params'].append(excluded_ids)
+        except ValueError:
+            print(f"Filtro 'estado_publicacion_id__not_in' inválido: {estado_publicacion_id_not_in_str}")
+
+    tsquery = build_search_tsquery(args.get('q') or '')
+    if tsquery:
+        search['from_sql'] += f" CROSS JOIN to_tsquery('{SEARCH_TS_CONFIG}', %s) AS tsq"
+        search['from_params'].append(tsquery)
+        search['filters'].append("p.search_vector @@ tsq")
+        search['sort_sql'] = "ts_rank_cd(p.search_vector, tsq, 1)::float8"
+
+    bbox = args.get('bbox')
+    if bbox:
+        search['filters'].append(f"{GEO_POINT_SQL} <@ box(point(%s, %s), point(%s, %s))")
+        search['params'].extend(parse_bbox(bbox))
+
+    near = args.get('near')
+    if near:
+        try:
+            lat, lng = (float(part) for part in near.split(','))
+        except ValueError:
+            raise ValueError("near must be 'lat,lng'")
+        radius_km = float(args.get('radius_km', GEO_DEFAULT_RADIUS_KM))
+        if not 0 < radius_km <= GEO_MAX_RADIUS_KM:
+            raise ValueError(f"radius_km must be between 0 and {GEO_MAX_RADIUS_KM:g}")
+
+        search['from_sql'] += " CROSS JOIN (SELECT %s::float8 AS lat, %s::float8 AS lng) AS geo_center"
+        search['from_params'].extend([lat, lng])
+        search['filters'].append(f"{GEO_POINT_SQL} <@ box(point(%s, %s), point(%s, %s))")
+        search['params'].extend(radius_bbox(lat, lng, radius_km))
+        search['filters'].append(f"{GEO_DISTANCE_SQL} <= %s")
+        search['params'].append(radius_km)
+        # Distance ordering takes precedence over relevance when both are given
+        search['sort_sql'] = GEO_DISTANCE_SQL
+        search['sort_desc'] = False
+        search['sort_alias'] = 'distancia_km'
+
+    for column in FACET_MULTI_VALUE_COLUMNS:
+        raw = args.get(column)
+        if raw:
+            try:
+                values = tuple(int(value) for value in raw.split(',') if value.strip())
+            except ValueError:
+                raise ValueError(f"{column} must be a comma-separated list of ids")
+            if values:
+                search['facet_filters'][column] = (f"p.{column} IN %s", [values])
+
+    for column in FACET_RANGE_COLUMNS:
+        conditions = []
+        range_params = []
+        for suffix, operator in (('_min', '>='), ('_max', '<=')):
+            raw = args.get(column + suffix)
+            if raw not in (None, ''):
+                try:
+                    range_params.append(Decimal(raw))
+                except InvalidOperation:
+                    raise ValueError(f"{column}{suffix} must be a number")
+                conditions.append(f"p.{column} {operator} %s")
+        if conditions:
+            search['facet_filters'][column] = (" AND ".join(conditions), range_params)
+
+    return search
+
+def parse_page_args(args):
+    """
+    Lee ?limit= y ?after= de la petición. Devuelve (limit, after_id, after_key) o lanza ValueError.
+    El cursor es "<id>" o, cuando el listado se ordena por otra clave (relevancia), "<clave>:<id>".
+    """
+    limit_str = args.get('limit')
+    after_str = args.get('after')
+
+    if limit_str is None and after_str is None:
+        return None, None, None
+
+    limit = PROPERTIES_DEFAULT_PAGE_SIZE
+    if limit_str is not None:
+        limit = int(limit_str)
+        if limit < 1:
+            raise ValueError("limit must be a positive integer")
+        limit = min(limit, PROPERTIES_MAX_PAGE_SIZE)
+
+    after_id = None
+    after_key = None
+    if after_str:
+        if ':' in after_str:
+            key_str, id_str = after_str.rsplit(':', 1)
+            after_key = float(key_str)
+            if not math.isfinite(after_key):
+                # nan/inf would make the keyset comparison match nothing or everything
+                raise ValueError("cursor key must be a finite number")
+            after_id = int(id_str)
+        else:
+            after_id = int(after_str)
+
+    return limit, after_id, after_key
+
+def encode_page_cursor(row, sort_key=None):
+    if sort_key is None:
+        return str(row['id'])
+    return f"{sort_key!r}:{row['id']}"
+
+def build_property_list_query(search, limit, after_id, after_key, fields=None):
+    """
+    Arma la consulta paginada del listado para una búsqueda y proyección. Devuelve (sql, params).
+    Con limit, los ids de la página se ordenan y recortan primero en una subconsulta y
+    la proyección (imágenes incluidas) solo se arma para esas filas.
+    """
+    sort_sql = search['sort_sql']
+
+    select_sql, join_sql = property_projection_sql(fields or parse_property_fields(None))
+    params = list(search['from_params'])
+
+    filters, where_params = search_where(search)
+    params += where_params
+
+    if after_id is not None:
+        if sort_sql and after_key is not None:
+            comparison = '<' if search['sort_desc'] else '>'
+            filters.append(f"({sort_sql} {comparison} %s OR ({sort_sql} = %s AND p.id < %s))")
+            params += [after_key, after_key, after_id]
+        else:
+            filters.append("p.id < %s")
+            params.append(after_id)
+
+    where_sql = " WHERE " + " AND ".join(filters) if filters else ""
+    order_sql = f" ORDER BY {property_list_order_sql(search)}"
+    sort_select_sql = f", {sort_sql} AS _sort_key" if sort_sql else ""
+
+    if limit is None:
+        query = (f"SELECT {select_sql}{sort_select_sql} FROM propiedades p {search['from_sql']}"
+                 + join_sql + where_sql + order_sql)
+        return query, params
+
+    # One extra row tells us whether there is a next page
+    params.append(limit + 1)
+    query = f"""
+        SELECT {select_sql}{", page_ids._sort_key" if sort_sql else ""}
+        FROM (
+            SELECT p.id{sort_select_sql}
+            FROM propiedades p {search['from_sql']}{where_sql}{order_sql}
+            LIMIT %s
+        ) page_ids
+        JOIN propiedades p ON p.id = page_ids.id
+        {join_sql}{order_sql}
+    """
+    return query, params
+
+def property_list_order_sql(search, alias='p'):
+    order_sql = f"{alias}.id DESC"
+    if search['sort_sql']:
+        sort_key = "_sort_key" if alias == 'p' else f"{alias}._sort_key"
+        order_sql = f"{sort_key} {'DESC' if search['sort_desc'] else 'ASC'}, " + order_sql
+    return order_sql
+
+def finish_property_page(propiedades, search, limit):
+    """Recorta la fila extra, calcula next_cursor y expone u oculta la clave de orden."""
+    next_cursor = None
+    if limit is not None and len(propiedades) > limit:
+        propiedades = propiedades[:limit]
+        next_cursor = encode_page_cursor(propiedades[-1], propiedades[-1].get('_sort_key'))
+
+    for propiedad in propiedades:
+        sort_key = propiedad.pop('_sort_key', None)
+        if search['sort_alias']:
+            propiedad[search['sort_alias']] = sort_key
+
+    return propiedades, next_cursor
+
 @app.route('/api/propiedades', methods=['GET', 'OPTIONS'])
 def get_properties():
     if request.method == 'OPTIONS':
@@ -493,61 +2015,210 @@ def get_properties():
     
     conn = None
     try:
-        tipo_negocio_id = request.args.get('tipo_negocio_id')
-        estado_publicacion_id_not_in_str = request.args.get('estado_publicacion_id__not_in')
-
-        query = """
-            SELECT p.*,
-                   json_agg(
-                       json_build_object(
-                           'id', pi.id,
-                           'url', pi.url,
-                           'nombre_archivo', pi.nombre_archivo,
-                           'es_principal', pi.es_principal,
-                           'orden', pi.orden
-                       ) ORDER BY pi.orden ASC
-                   ) FILTER (WHERE pi.id IS NOT NULL) as imagenes
-            FROM propiedades p
-            LEFT JOIN propiedades_imagenes pi ON p.id = pi.propiedad_id
+        try:
+            limit, after_id, after_key = parse_page_args(request.args)
+        except ValueError:
+            return jsonify({"error": "Parámetros de paginación inválidos ('limit' y 'after' deben ser cursores válidos)"}), 400
+
+        try:
+            search = build_property_search(request.args)
+        except ValueError as e:
+            return jsonify({"error": f"Filtro inválido: {e}"}), 400
+
+        try:
+            fields = parse_property_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({"error": f"Parámetro 'fields' inválido: {e}"}), 400
+
+        query, params = build_property_list_query(search, limit, after_id, after_key, fields)
+
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(query, tuple(params))
+        propiedades = cursor.fetchall()
+        cursor.close()
+
+        propiedades, next_cursor = finish_property_page(propiedades, search, limit)
+        return jsonify({"properties": propiedades, "next_cursor": next_cursor})
+    except Exception as e:
+        print(f"Error en get_properties: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+def build_facets_sql(search):
+    """
+    CTE "facets" con los conteos por valor de cada faceta y el rango de precios.
+    Cada faceta aplica todos los filtros menos el suyo. Devuelve (sql, params).
+    """
+    params = list(search['from_params']) + list(search['params'])
+    base_columns = ", ".join(f"p.{column}" for column in ('id',) + FACET_COUNT_COLUMNS + ('precio',))
+    sql = f"""
+        base AS (
+            SELECT {base_columns}
+            FROM propiedades p {search['from_sql']}
+            WHERE {" AND ".join(search['filters'])}
+        ),
+        facets AS (
+            SELECT json_build_object(
+    """
+    facet_only = {"filters": [], "params": [], "facet_filters": search['facet_filters']}
+    entries = []
+
+    filters, total_params = search_where(facet_only)
+    entries.append(f"'total', (SELECT COUNT(*) FROM base p WHERE {' AND '.join(filters or ['TRUE'])})")
+    params += total_params
+
+    for column in FACET_COUNT_COLUMNS:
+        filters, facet_params = search_where(facet_only, exclude=column)
+        filters.append(f"p.{column} IS NOT NULL")
+        entries.append(f"""'{column}', (
+                SELECT COALESCE(json_agg(json_build_object('value', f.value, 'count', f.count)
+                                         ORDER BY f.count DESC, f.value), '[]'::json)
+                FROM (
+                    SELECT p.{column} AS value, COUNT(*) AS count
+                    FROM base p
+                    WHERE {" AND ".join(filters)}
+                    GROUP BY p.{column}
+                ) f
+            )""")
+        params += facet_params
+
+    filters, price_params = search_where(facet_only, exclude='precio')
+    entries.append(f"""'precio', (
+                SELECT json_build_object('min', MIN(p.precio), 'max', MAX(p.precio))
+                FROM base p
+                WHERE {" AND ".join(filters or ['TRUE'])}
+            )""")
+    params += price_params
+
+    sql += ",\n".join(entries) + ") AS data\n        )"
+    return sql, params
+
+@app.route('/api/propiedades/search', methods=['GET', 'OPTIONS'])
+def search_properties():
+    """Listado paginado con filtros de facetas y conteos por faceta, en una sola consulta"""
+    if request.method == 'OPTIONS':
+        return '', 204
+
+    conn = None
+    try:
+        try:
+            limit, after_id, after_key = parse_page_args(request.args)
+            search = build_property_search(request.args)
+            fields = parse_property_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({"error": f"Parámetros inválidos: {e}"}), 400
+        limit = limit or PROPERTIES_DEFAULT_PAGE_SIZE
+
+        facets_sql, facets_params = build_facets_sql(search)
+        page_sql, page_params = build_property_list_query(search, limit, after_id, after_key, fields)
+        order_sql = property_list_order_sql(search, alias='page')
+
+        # The facets row is attached to the first page row only (or returned
+        # alone when the page is empty), so it crosses the wire once.
+        query = f"""
+            WITH {facets_sql}
+            SELECT page.*,
+                   CASE WHEN row_number() OVER (ORDER BY {order_sql}) = 1 THEN facets.data END AS _facets
+            FROM facets
+            LEFT JOIN ({page_sql}) page ON TRUE
+            ORDER BY {order_sql}
         """
 
-        filters = ["p.deleted_at IS NULL"]
-        params = []
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(query, tuple(facets_params + page_params))
+        rows = cursor.fetchall()
+        cursor.close()
 
-        if tipo_negocio_id:
-            filters.append("p.tipo_negocio_id = %s")
-            params.append(tipo_negocio_id)
+        facets = rows[0]['_facets'] if rows else None
+        propiedades = []
+        for row in rows:
+            row.pop('_facets', None)
+            if row['id'] is not None:
+                propiedades.append(row)
 
-        if estado_publicacion_id_not_in_str:
-            try:
-                excluded_ids = tuple(int(id) for id in estado_publicacion_id_not_in_str.split(','))
-                if excluded_ids:
-                    filters.append("p.estado_publicacion_id NOT IN %s")
-                    params.append(excluded_ids)
-            except ValueError:
-                print(f"Filtro 'estado_publicacion_id__not_in' inválido: {estado_publicacion_id_not_in_str}")
+        propiedades, next_cursor = finish_property_page(propiedades, search, limit)
+        total = facets.pop('total') if facets else 0
+        return jsonify({"properties": propiedades, "next_cursor": next_cursor, "total": total, "facets": facets})
+    except Exception as e:
+        print(f"Error en search_properties: {e}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+CLUSTER_MAX_RESULTS = int(os.getenv("CLUSTER_MAX_RESULTS", "500"))
 
-        if filters:
-            query += " WHERE " + " AND ".join(filters)
+def geohash_precision_for_zoom(zoom):
+    """Longitud del prefijo de geohash para un nivel de zoom del mapa (0-20)."""
+    return max(1, min(GEOHASH_PRECISION, (zoom + 1) // 2))
+
+@app.route('/api/propiedades/clusters', methods=['GET', 'OPTIONS'])
+def get_property_clusters():
+    """Agrupa las propiedades de un bbox por celda de geohash según el zoom (conteo, centroide y rango de precio)"""
+    if request.method == 'OPTIONS':
+        return '', 204
 
-        query += """
-            GROUP BY p.id
-            ORDER BY p.id DESC;
+    conn = None
+    try:
+        if not request.args.get('bbox'):
+            return jsonify({"error": "bbox is required"}), 400
+        try:
+            zoom = int(request.args.get('zoom', '10'))
+            search = build_property_search(request.args)
+        except ValueError as e:
+            return jsonify({"error": f"Filtro inválido: {e}"}), 400
+
+        precision = geohash_precision_for_zoom(zoom)
+        filters, where_params = search_where(search)
+        filters.append("p.geohash IS NOT NULL")
+        query = f"""
+            SELECT left(p.geohash, %s) AS geohash,
+                   COUNT(*) AS count,
+                   AVG(p.lat::float8) AS lat,
+                   AVG(p.lng::float8) AS lng,
+                   MIN(p.precio) AS precio_min,
+                   MAX(p.precio) AS precio_max,
+                   CASE WHEN COUNT(*) = 1 THEN MIN(p.id) END AS propiedad_id
+            FROM propiedades p {search['from_sql']}
+            WHERE {" AND ".join(filters)}
+            GROUP BY 1
+            ORDER BY count DESC
+            LIMIT %s
         """
+        params = [precision] + search['from_params'] + where_params + [CLUSTER_MAX_RESULTS]
 
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         cursor.execute(query, tuple(params))
-        propiedades = cursor.fetchall()
+        clusters = cursor.fetchall()
         cursor.close()
-        return jsonify({"properties": propiedades})
+
+        return jsonify({"zoom": zoom, "precision": precision, "clusters": clusters})
     except Exception as e:
-        print(f"Error en get_properties: {e}")
+        print(f"Error en get_property_clusters: {e}")
         return jsonify({"error": str(e)}), 500
     finally:
         if conn:
             return_db_connection(conn)
 
+PROPERTY_DETAIL_SQL = """
+    SELECT {}
+    FROM propiedades p
+    {}
+    WHERE p.id = %s AND p.deleted_at IS NULL
+"""
+# Prepared variants of the detail query for the default and "card" projections
+PROPERTY_DETAIL_QUERIES = {
+    None: register_query('property_detail', PROPERTY_DETAIL_SQL.format(
+        *property_projection_sql(parse_property_fields(None)))),
+    'card': register_query('property_detail_card', PROPERTY_DETAIL_SQL.format(
+        *property_projection_sql(parse_property_fields('card'))))
+}
+
 @app.route('/api/propiedades/<int:id>', methods=['GET', 'OPTIONS'])
 def get_property(id):
     if request.method == 'OPTIONS':
@@ -555,31 +2226,28 @@ def get_property(id):
     
     conn = None
     try:
+        try:
+            fields = parse_property_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({"error": f"Parámetro 'fields' inválido: {e}"}), 400
+
         conn = get_db_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        query = """
-            SELECT p.*,
-                   json_agg(
-                       json_build_object(
-                           'id', pi.id,
-                           'url', pi.url,
-                           'nombre_archivo', pi.nombre_archivo,
-                           'es_principal', pi.es_principal,
-                           'orden', pi.orden
-                       ) ORDER BY pi.orden ASC
-                   ) FILTER (WHERE pi.id IS NOT NULL) as imagenes
-            FROM propiedades p
-            LEFT JOIN propiedades_imagenes pi ON p.id = pi.propiedad_id
-            WHERE p.id = %s AND p.deleted_at IS NULL
-            GROUP BY p.id;
-        """
-        cursor.execute(query, (id,))
+        prepared_name = PROPERTY_DETAIL_QUERIES.get(request.args.get('fields') or None)
+        if prepared_name:
+            execute_prepared(cursor, prepared_name, (id,))
+        else:
+            cursor.execute(PROPERTY_DETAIL_SQL.format(*property_projection_sql(fields)), (id,))
         propiedad = cursor.fetchone()
         cursor.close()
 
         if propiedad:
-            return jsonify(propiedad)
+            response = jsonify(propiedad)
+            last_modified = _last_modified(propiedad)
+            if last_modified:
+                response.last_modified = last_modified
+            return response
         else:
             return jsonify({"error": "Propiedad no encontrada"}), 404
     except Exception as e:
@@ -589,6 +2257,24 @@ def get_property(id):
         if conn:
             return_db_connection(conn)
 
+PROPERTY_INSERT_QUERY = register_query('property_insert', """
+    INSERT INTO propiedades (
+        titulo, descripcion, precio, precio_alquiler, valor_administracion,
+        habitaciones, alcobas, banos, banos_medios, estacionamientos,
+        anio_construccion, piso, m2_terreno, m2_construccion, m2_privada,
+        direccion, codigo_postal, lat, lng, registro_publico,
+        convenio_url, convenio_validado,
+        tipo_negocio_id, tipo_propiedad_id, estado_publicacion_id,
+        captado_por_agente_id, moneda_id, frecuencia_alquiler_id,
+        estado_fisico_id, estado_id, ciudad_id, zona_id, agente_id,
+        agente_externo_id, validado_por_usuario_id, geohash
+    ) VALUES (
+        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+        %s, %s, %s, %s, %s, %s
+    ) RETURNING id;
+""")
+
 @app.route('/api/propiedades', methods=['POST'])
 def add_property():
     data = request.json
@@ -597,25 +2283,7 @@ def add_property():
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        query = """
-            INSERT INTO propiedades (
-                titulo, descripcion, precio, precio_alquiler, valor_administracion,
-                habitaciones, alcobas, banos, banos_medios, estacionamientos,
-                anio_construccion, piso, m2_terreno, m2_construccion, m2_privada,
-                direccion, codigo_postal, lat, lng, registro_publico,
-                convenio_url, convenio_validado,
-                tipo_negocio_id, tipo_propiedad_id, estado_publicacion_id,
-                captado_por_agente_id, moneda_id, frecuencia_alquiler_id,
-                estado_fisico_id, estado_id, ciudad_id, zona_id, agente_id,
-                agente_externo_id, validado_por_usuario_id
-            ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                %s, %s, %s, %s, %s
-            ) RETURNING id;
-        """
-
-        cursor.execute(query, (
+        execute_prepared(cursor, PROPERTY_INSERT_QUERY, (
             data.get('titulo'), data.get('descripcion'), data.get('precio'), data.get('precio_alquiler'), data.get('valor_administracion'),
             data.get('habitaciones', 0), data.get('alcobas', 0), data.get('banos', 0), data.get('banos_medios', 0), data.get('estacionamientos', 0),
             data.get('anio_construccion'), data.get('piso'), data.get('m2_terreno', 0), data.get('m2_construccion', 0), data.get('m2_privada', 0),
@@ -624,11 +2292,13 @@ def add_property():
             data.get('tipo_negocio_id'), data.get('tipo_propiedad_id'), data.get('estado_publicacion_id'),
             data.get('captado_por_agente_id'), data.get('moneda_id'), data.get('frecuencia_alquiler_id'),
             data.get('estado_fisico_id'), data.get('estado_id'), data.get('ciudad_id'), data.get('zona_id'), data.get('agente_id'),
-            data.get('agente_externo_id'), data.get('validado_por_usuario_id')
+            data.get('agente_externo_id'), data.get('validado_por_usuario_id'),
+            property_geohash(data.get('lat'), data.get('lng'))
         ))
 
         new_id = cursor.fetchone()[0]
         conn.commit()
+        mark_dashboard_stats_dirty()
         cursor.close()
         return jsonify({"status": "success", "id": new_id}), 201
 
@@ -640,6 +2310,22 @@ def add_property():
         if conn:
             return_db_connection(conn)
 
+PROPERTY_UPDATE_QUERY = register_query('property_update', """
+    UPDATE propiedades SET
+        titulo = %s, descripcion = %s, precio = %s, precio_alquiler = %s,
+        valor_administracion = %s, habitaciones = %s, alcobas = %s, banos = %s,
+        banos_medios = %s, estacionamientos = %s, anio_construccion = %s, piso = %s,
+        m2_terreno = %s, m2_construccion = %s, m2_privada = %s, direccion = %s,
+        codigo_postal = %s, lat = %s, lng = %s, registro_publico = %s,
+        convenio_url = %s, convenio_validado = %s,
+        tipo_negocio_id = %s, tipo_propiedad_id = %s, estado_publicacion_id = %s,
+        captado_por_agente_id = %s, moneda_id = %s, frecuencia_alquiler_id = %s,
+        estado_fisico_id = %s, estado_id = %s, ciudad_id = %s, zona_id = %s,
+        agente_id = %s, agente_externo_id = %s, validado_por_usuario_id = %s,
+        geohash = %s, updated_at = NOW()
+    WHERE id = %s;
+""")
+
 @app.route('/api/propiedades/<int:id>', methods=['PUT'])
 def update_property(id):
     data = request.json
@@ -648,23 +2334,7 @@ def update_property(id):
         conn = get_db_connection()
         cursor = conn.cursor()
 
-        query = """
-            UPDATE propiedades SET
-                titulo = %s, descripcion = %s, precio = %s, precio_alquiler = %s,
-                valor_administracion = %s, habitaciones = %s, alcobas = %s, banos = %s,
-                banos_medios = %s, estacionamientos = %s, anio_construccion = %s, piso = %s,
-                m2_terreno = %s, m2_construccion = %s, m2_privada = %s, direccion = %s,
-                codigo_postal = %s, lat = %s, lng = %s, registro_publico = %s,
-                convenio_url = %s, convenio_validado = %s,
-                tipo_negocio_id = %s, tipo_propiedad_id = %s, estado_publicacion_id = %s,
-                captado_por_agente_id = %s, moneda_id = %s, frecuencia_alquiler_id = %s,
-                estado_fisico_id = %s, estado_id = %s, ciudad_id = %s, zona_id = %s,
-                agente_id = %s, agente_externo_id = %s, validado_por_usuario_id = %s,
-                updated_at = NOW()
-            WHERE id = %s;
-        """
-
-        cursor.execute(query, (
+        execute_prepared(cursor, PROPERTY_UPDATE_QUERY, (
             data.get('titulo'), data.get('descripcion'), data.get('precio'), data.get('precio_alquiler'),
             data.get('valor_administracion'), data.get('habitaciones'), data.get('alcobas'), data.get('banos'),
             data.get('banos_medios'), data.get('estacionamientos'), data.get('anio_construccion'), data.get('piso'),
@@ -675,10 +2345,12 @@ def update_property(id):
             data.get('captado_por_agente_id'), data.get('moneda_id'), data.get('frecuencia_alquiler_id'),
             data.get('estado_fisico_id'), data.get('estado_id'), data.get('ciudad_id'), data.get('zona_id'),
             data.get('agente_id'), data.get('agente_externo_id'), data.get('validado_por_usuario_id'),
+            property_geohash(data.get('lat'), data.get('lng')),
             id
         ))
         updated_rows = cursor.rowcount
         conn.commit()
+        mark_dashboard_stats_dirty()
         cursor.close()
         if updated_rows == 0:
             return jsonify({"error": "Propiedad no encontrada"}), 404
@@ -692,6 +2364,89 @@ def update_property(id):
         if conn:
             return_db_connection(conn)
 
+def _last_modified(propiedad):
+    """updated_at (o created_at) como datetime UTC con precisión de segundos, como en HTTP."""
+    stamp = propiedad.get('updated_at') or propiedad.get('created_at')
+    if stamp is None:
+        return None
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=timezone.utc)
+    return stamp.astimezone(timezone.utc).replace(microsecond=0)
+
+@app.route('/api/propiedades/<int:id>', methods=['PATCH'])
+def patch_property(id):
+    """
+    Actualización parcial: sólo escribe las columnas presentes en el cuerpo.
+    Con If-Unmodified-Since responde 412 si la propiedad cambió después de esa fecha.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data:
+        return jsonify({"error": "El cuerpo debe ser un objeto JSON con al menos un campo"}), 400
+
+    unknown = sorted(field for field in data if field not in PROPERTY_COLUMNS)
+    if unknown:
+        return jsonify({"error": f"Campos no permitidos: {', '.join(unknown)}"}), 400
+
+    try:
+        changes = {column: _coerce_property_value(column, value) for column, value in data.items()}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if 'titulo' in changes and not changes['titulo']:
+        return jsonify({"error": "'titulo' is required"}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+        # Row lock: the precondition check and the geohash recomputation
+        # below must see the same version of the row the UPDATE writes.
+        cursor.execute("""
+            SELECT lat, lng, created_at, updated_at FROM propiedades
+            WHERE id = %s AND deleted_at IS NULL
+            FOR UPDATE;
+        """, (id,))
+        current = cursor.fetchone()
+        if current is None:
+            conn.rollback()
+            return jsonify({"error": "Propiedad no encontrada"}), 404
+
+        if_unmodified_since = request.if_unmodified_since
+        last_modified = _last_modified(current)
+        if if_unmodified_since and last_modified and last_modified > if_unmodified_since:
+            conn.rollback()
+            response = jsonify({"error": "La propiedad fue modificada por otra petición",
+                                "updated_at": last_modified.isoformat()})
+            response.last_modified = last_modified
+            return response, 412
+
+        if 'lat' in changes or 'lng' in changes:
+            changes['geohash'] = property_geohash(changes.get('lat', current['lat']),
+                                                  changes.get('lng', current['lng']))
+
+        assignments = ", ".join(f"{column} = %s" for column in changes)
+        cursor.execute(
+            f"UPDATE propiedades SET {assignments}, updated_at = NOW() WHERE id = %s RETURNING created_at, updated_at;",
+            tuple(changes.values()) + (id,)
+        )
+        updated = cursor.fetchone()
+        conn.commit()
+        mark_dashboard_stats_dirty()
+        cursor.close()
+
+        response = jsonify({"status": "success", "updated_fields": sorted(data),
+                            "updated_at": updated['updated_at'].isoformat()})
+        response.last_modified = _last_modified(updated)
+        return response
+
+    except Exception as e:
+        print(f"Error en patch_property: {e}")
+        if conn: conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn:
+            return_db_connection(conn)
+
 @app.route('/api/propiedades/<int:id>', methods=['DELETE'])
 def delete_property(id):
     conn = None
@@ -701,6 +2456,7 @@ def delete_property(id):
         cursor.execute("UPDATE propiedades SET deleted_at = NOW() WHERE id = %s;", (id,))
         deleted_rows = cursor.rowcount
         conn.commit()
+        mark_dashboard_stats_dirty()
         cursor.close()
         if deleted_rows == 0:
              return jsonify({"error": "Propiedad no encontrada"}), 404
@@ -713,47 +2469,431 @@ def delete_property(id):
         if conn:
             return_db_connection(conn)
 
-# --- Endpoints de Imágenes ---
-@app.route('/api/propiedades/<int:propiedad_id>/imagenes', methods=['POST'])
-def upload_image(propiedad_id):
-    """Subir una imagen a Supabase Storage y guardar referencia en BD"""
-    if 'file' not in request.files:
-        return jsonify({"error": "No file provided"}), 400
-
-    file = request.files['file']
-    es_principal = request.form.get('es_principal', 'false').lower() == 'true'
-
-    if file.filename == '':
-        return jsonify({"error": "No file selected"}), 400
-
-    if not allowed_file(file.filename):
-        return jsonify({"error": "File type not allowed"}), 400
+# --- Visit Counter ---
+# Visits are counted in memory per process and written as one batched UPDATE
+# every VISIT_FLUSH_INTERVAL seconds, instead of one row-locking UPDATE per
+# page view. Pending counts are flushed on worker exit (gunicorn worker_exit
+# hook) and at interpreter exit; a failed flush puts the deltas back.
+# The endpoint is public and ids are not checked against the table, so the
+# buffer holds at most VISIT_BUFFER_MAX_IDS distinct ids: once full, visits
+# to ids not already buffered are refused and a flush is brought forward.
+VISIT_FLUSH_INTERVAL = float(os.getenv("VISIT_FLUSH_INTERVAL", "10"))
+VISIT_BUFFER_MAX_IDS = int(os.getenv("VISIT_BUFFER_MAX_IDS", "10000"))
+PROPERTY_ID_MAX = 2147483647  # propiedades.id is a serial (int4)
+
+_visit_counts = {}
+_visit_lock = threading.Lock()
+_visit_flush_timer = None
+
+def _schedule_visit_flush(delay=VISIT_FLUSH_INTERVAL):
+    """Arranca el temporizador de volcado (o lo adelanta a `delay`). Llamar con _visit_lock tomado."""
+    global _visit_flush_timer
+    if _visit_flush_timer is not None:
+        if _visit_flush_timer.interval <= delay:
+            return
+        _visit_flush_timer.cancel()
+    _visit_flush_timer = threading.Timer(delay, _flush_visits_from_timer)
+    _visit_flush_timer.daemon = True
+    _visit_flush_timer.start()
+
+def _flush_visits_from_timer():
+    global _visit_flush_timer
+    with _visit_lock:
+        _visit_flush_timer = None
+    flush_visit_counts()
+
+def record_visit(propiedad_id, count=1):
+    """Suma visitas al buffer. Devuelve False si está lleno y la propiedad no estaba en él."""
+    with _visit_lock:
+        if propiedad_id not in _visit_counts and len(_visit_counts) >= VISIT_BUFFER_MAX_IDS:
+            _schedule_visit_flush(0)
+            return False
+        _visit_counts[propiedad_id] = _visit_counts.get(propiedad_id, 0) + count
+        _schedule_visit_flush()
+        return True
+
+def flush_visit_counts():
+    """Escribe los contadores pendientes en propiedades.visitas. Devuelve cuántas propiedades se actualizaron."""
+    global _visit_counts
+    with _visit_lock:
+        pending, _visit_counts = _visit_counts, {}
+    if not pending:
+        return 0
 
     conn = None
     try:
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{propiedad_id}_{uuid.uuid4().hex}.{file_extension}"
-        file_path = f"propiedades/{unique_filename}"
-
-        file_content = file.read()
-
-        get_supabase_client().storage.from_(BUCKET_NAME).upload(
-            file_path,
-            file_content,
-            file_options={"content-type": file.content_type}
-        )
-
-        public_url = get_supabase_client().storage.from_(BUCKET_NAME).get_public_url(file_path)
-
         conn = get_db_connection()
         cursor = conn.cursor()
+        # Sorted ids: every worker locks rows in the same order, so
+        # concurrent flushes cannot deadlock each other.
+        execute_values(cursor, """
+            UPDATE propiedades p
+            SET visitas = COALESCE(p.visitas, 0) + v.delta
+            FROM (VALUES %s) AS v(id, delta)
+            WHERE p.id = v.id
+        """, sorted(pending.items()), page_size=len(pending))
+        conn.commit()
+        cursor.close()
+        mark_dashboard_stats_dirty()
+        print(f"👣 Visitas volcadas: {sum(pending.values())} en {len(pending)} propiedades")
+        return len(pending)
+    except Exception as e:
+        print(f"Error volcando visitas: {e}")
+        if conn: conn.rollback()
+        with _visit_lock:
+            for propiedad_id, count in pending.items():
+                _visit_counts[propiedad_id] = _visit_counts.get(propiedad_id, 0) + count
+            _schedule_visit_flush()
+        return 0
+    finally:
+        if conn:
+            return_db_connection(conn)
+
+atexit.register(flush_visit_counts)
+
+@app.route('/api/propiedades/<int:id>/visitas', methods=['POST', 'OPTIONS'])
+def record_property_visit(id):
+    """Registra una visita; se escribe en la base de datos en el siguiente volcado"""
+    if request.method == 'OPTIONS':
+        return '', 204
+    if id > PROPERTY_ID_MAX:
+        # Would make the whole batched UPDATE fail on every retry
+        return jsonify({"error": "Propiedad no encontrada"}), 404
+    if not record_visit(id):
+        response = jsonify({"error": "Demasiadas visitas pendientes, reintenta en unos segundos"})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(math.ceil(VISIT_FLUSH_INTERVAL))
+        return response
+    return jsonify({"status": "queued"}), 202
+
+# --- Bulk Import ---
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+IMPORT_COLUMNS = PROPERTY_COLUMNS + ('geohash',)
+
+def load_catalog_lookup(cursor):
+    """Carga todos los catálogos en una sola consulta: {tabla: {nombre_normalizado: id}}."""
+    tables = sorted(set(PROPERTY_CATALOG_COLUMNS.values()))
+    cursor.execute(" UNION ALL ".join(
+        f"SELECT '{tabla}' AS tabla, id, nombre FROM public.{tabla}" for tabla in tables
+    ))
+    lookup = {tabla: {} for tabla in tables}
+    for tabla, catalog_id, nombre in cursor.fetchall():
+        if nombre:
+            lookup[tabla][nombre.strip().lower()] = catalog_id
+    return lookup
+
+def _coerce_property_value(column, value):
+    if value is None or (isinstance(value, str) and value.strip() == ''):
+        return None
+    if column in PROPERTY_BOOLEAN_COLUMNS:
+        if isinstance(value, bool):
+            return value
+        normalized = str(value).strip().lower()
+        if normalized in ('true', '1', 'si', 'sí', 'yes', 't'):
+            return True
+        if normalized in ('false', '0', 'no', 'f'):
+            return False
+        raise ValueError(f"'{column}' must be a boolean")
+    if column in PROPERTY_INTEGER_COLUMNS:
+        try:
+            return int(str(value).strip())
+        except ValueError:
+            raise ValueError(f"'{column}' must be an integer")
+    if column in PROPERTY_DECIMAL_COLUMNS:
+        try:
+            return Decimal(str(value).strip())
+        except InvalidOperation:
+            raise ValueError(f"'{column}' must be a number")
+    # Text columns: scalars only, so objects/lists never get stored as their repr
+    if isinstance(value, bool) or not isinstance(value, (str, int, float, Decimal)):
+        raise ValueError(f"'{column}' must be a string")
+    return str(value)
+
+def validate_import_record(record, catalogs):
+    """Convierte un registro de importación en la tupla de valores de IMPORT_COLUMNS o lanza ValueError."""
+    values = {}
+    for column in PROPERTY_COLUMNS:
+        value = record.get(column)
+        catalog = PROPERTY_CATALOG_COLUMNS.get(column)
+        name = record.get(column[:-3]) if catalog else None
+        if catalog and value in (None, '') and name not in (None, ''):
+            value = catalogs[catalog].get(str(name).strip().lower())
+            if value is None:
+                raise ValueError(f"Unknown {column[:-3]} '{name}'")
+        value = _coerce_property_value(column, value)
+        if value is None:
+            value = PROPERTY_INSERT_DEFAULTS.get(column)
+        values[column] = value
+
+    if not values['titulo']:
+        raise ValueError("'titulo' is required")
+    return tuple(values[column] for column in PROPERTY_COLUMNS) + (property_geohash(values['lat'], values['lng']),)
+
+def iter_import_records(stream, fmt):
+    """Genera (número_de_registro, dict) desde un stream de texto CSV o NDJSON."""
+    if fmt == 'csv':
+        for number, record in enumerate(csv.DictReader(stream), start=1):
+            if None in record:
+                # DictReader puts fields beyond the header under the key None
+                yield number, ValueError(f"Row has {len(record[None])} more field(s) than the header")
+                continue
+            yield number, record
+        return
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, ValueError(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(record, dict):
+            yield number, ValueError("Each line must be a JSON object")
+            continue
+        yield number, record
+
+def _detect_import_format(upload):
+    fmt = (request.args.get('format') or '').lower()
+    if not fmt and upload is not None and upload.filename:
+        fmt = upload.filename.rsplit('.', 1)[-1].lower()
+    if not fmt:
+        content_type = (upload.content_type if upload is not None else request.content_type) or ''
+        fmt = 'csv' if 'csv' in content_type else 'ndjson'
+    if fmt in ('jsonl', 'json', 'ndjson', 'x-ndjson'):
+        return 'ndjson'
+    return fmt
+
+def insert_import_batch(conn, batch):
+    """
+    Inserta un lote con un INSERT multi-fila. Si el lote falla, reintenta fila a fila
+    con savepoints para aislar las filas con error. Devuelve (ids, errores).
+    """
+    cursor = conn.cursor()
+    query = f"INSERT INTO propiedades ({', '.join(IMPORT_COLUMNS)}) VALUES %s RETURNING id"
+    try:
+        rows = execute_values(cursor, query, [values for _, values in batch], page_size=len(batch), fetch=True)
+        conn.commit()
+        return [row[0] for row in rows], []
+    except psycopg2.Error:
+        conn.rollback()
+
+    ids, errors = [], []
+    single_query = f"INSERT INTO propiedades ({', '.join(IMPORT_COLUMNS)}) VALUES ({', '.join(['%s'] * len(IMPORT_COLUMNS))}) RETURNING id"
+    for number, values in batch:
+        cursor.execute("SAVEPOINT import_row")
+        try:
+            cursor.execute(single_query, values)
+            ids.append(cursor.fetchone()[0])
+            cursor.execute("RELEASE SAVEPOINT import_row")
+        except psycopg2.Error as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT import_row")
+            errors.append({"row": number, "error": str(e).strip()})
+    conn.commit()
+    cursor.close()
+    return ids, errors
+
+@app.route('/api/propiedades/import', methods=['POST'])
+def import_properties():
+    """Importación masiva de propiedades desde CSV o NDJSON (archivo 'file' o cuerpo de la petición)"""
+    try:
+        requesting_user_id = get_user_id_from_token(request)
+        if not is_admin(requesting_user_id):
+            return jsonify({"error": "Admin privileges required"}), 403
+
+        upload = request.files.get('file')
+        fmt = _detect_import_format(upload)
+        if fmt not in ('csv', 'ndjson'):
+            return jsonify({"error": "Unsupported format. Use csv or ndjson"}), 400
+
+        raw_stream = upload.stream if upload is not None else request.stream
+        stream = io.TextIOWrapper(raw_stream, encoding='utf-8-sig', newline='')
+
+        conn = None
+        inserted_ids = []
+        errors = []
+        ignored_columns = set()
+        last_row = None
+        truncated = False
+        try:
+            conn = get_db_connection()
+            catalog_cursor = conn.cursor()
+            catalogs = load_catalog_lookup(catalog_cursor)
+            catalog_cursor.close()
+
+            known_columns = set(PROPERTY_COLUMNS) | {column[:-3] for column in PROPERTY_CATALOG_COLUMNS}
+            batch = []
+            for number, record in iter_import_records(stream, fmt):
+                last_row = number
+                try:
+                    if isinstance(record, Exception):
+                        raise record
+                    ignored_columns.update(key for key in record if key not in known_columns)
+                    batch.append((number, validate_import_record(record, catalogs)))
+                except ValueError as e:
+                    errors.append({"row": number, "error": str(e)})
+
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    ids, batch_errors = insert_import_batch(conn, batch)
+                    inserted_ids.extend(ids)
+                    errors.extend(batch_errors)
+                    batch = []
+
+                if len(errors) >= IMPORT_MAX_ERRORS:
+                    # The rest of the file is not read; the response says so
+                    truncated = True
+                    break
+
+            if batch:
+                ids, batch_errors = insert_import_batch(conn, batch)
+                inserted_ids.extend(ids)
+                errors.extend(batch_errors)
+
+        except csv.Error as e:
+            if conn: conn.rollback()
+            errors.append({"row": None, "error": f"Invalid CSV: {e}"})
+        except Exception as e:
+            if conn: conn.rollback()
+            print(f"Error en import_properties: {e}")
+            return jsonify({"error": f"Database error: {str(e)}", "inserted": len(inserted_ids), "ids": inserted_ids}), 500
+        finally:
+            if conn:
+                return_db_connection(conn)
+
+        if inserted_ids:
+            mark_dashboard_stats_dirty()
+
+        errors.sort(key=lambda error: error['row'] or 0)
+        return jsonify({
+            "status": "success" if not errors else ("partial" if inserted_ids else "failed"),
+            "inserted": len(inserted_ids),
+            "ids": inserted_ids,
+            "errors": errors,
+            "ignored_columns": sorted(ignored_columns, key=str),
+            "truncated": truncated,
+            "last_row": last_row
+        }), 201 if inserted_ids else 400
+
+    except Exception as e:
+        print(f"Auth error during import_properties: {e}")
+        if "Invalid token" in str(e) or "No token provided" in str(e):
+            return jsonify({"error": str(e)}), 401
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
+# --- Export ---
+# The inventory is streamed from a server-side (named) cursor in fetchmany
+# batches, so worker memory stays flat regardless of table size.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+def _csv_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+def export_connection_releaser(conn):
+    """Devuelve una función idempotente que libera la conexión del export.
+
+    Se llama tanto desde el generador como desde Response.call_on_close: si el
+    generador nunca arranca (HEAD, cliente que se desconecta antes del primer
+    chunk) su finally no se ejecuta y solo call_on_close libera la conexión.
+    """
+    released = threading.Lock()
+
+    def release():
+        if not released.acquire(blocking=False):
+            return
+        try:
+            conn.rollback()
+        except Exception as e:
+            print(f"⚠️  Rollback del export fallido, se descarta la conexión: {e}")
+            return_db_connection(conn, close=True)
+            return
+        return_db_connection(conn)
+
+    return release
+
+def stream_property_export(conn, fmt, release):
+    """Generador que emite el inventario en NDJSON o CSV y libera la conexión al terminar."""
+    try:
+        cursor = conn.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+        cursor.itersize = EXPORT_BATCH_SIZE
+        cursor.execute(f"SELECT {PROPERTY_SELECT_SQL} FROM propiedades p WHERE p.deleted_at IS NULL ORDER BY p.id ASC")
+
+        writer = None
+        buffer = io.StringIO()
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            if fmt == 'ndjson':
+                yield ''.join(app.json.dumps(row) + '\n' for row in rows)
+                continue
+            if writer is None:
+                writer = csv.writer(buffer)
+                writer.writerow([column.name for column in cursor.description])
+            for row in rows:
+                writer.writerow([_csv_value(value) for value in row.values()])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+        cursor.close()
+    except Exception as e:
+        print(f"Error en export de propiedades: {e}")
+        raise
+    finally:
+        release()
+
+@app.route('/api/propiedades/export', methods=['GET'])
+def export_properties():
+    """Exporta todas las propiedades activas en NDJSON (por defecto) o CSV"""
+    try:
+        requesting_user_id = get_user_id_from_token(request)
+        if not is_admin(requesting_user_id):
+            return jsonify({"error": "Admin privileges required"}), 403
+
+        fmt = request.args.get('format', 'ndjson').lower()
+        if fmt not in ('csv', 'ndjson'):
+            return jsonify({"error": "Unsupported format. Use csv or ndjson"}), 400
+
+        conn = get_db_connection()
+        release = export_connection_releaser(conn)
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        filename = f"propiedades_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{fmt}"
+        response = Response(
+            stream_property_export(conn, fmt, release),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+        response.call_on_close(release)
+        return response
+
+    except Exception as e:
+        print(f"Error en export_properties: {e}")
+        if "Invalid token" in str(e) or "No token provided" in str(e):
+            return jsonify({"error": str(e)}), 401
+        return jsonify({"error": str(e)}), 500
+
+# --- Endpoints de Imágenes ---
+def store_property_image(propiedad_id, local_path, unique_filename, content_type, es_principal):
+    """Sube el archivo temporal a Storage y registra la imagen en BD. Borra el temporal al terminar."""
+    file_path = f"propiedades/{unique_filename}"
+    conn = None
+    uploaded = False
+    handed_off = False
+    try:
+        public_url = upload_file_to_storage(file_path, local_path, content_type)
+        uploaded = True
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        if es_principal:
+            cursor.execute(
+                "UPDATE propiedades_imagenes SET es_principal = FALSE WHERE propiedad_id = %s;",
+                (propiedad_id,)
+            )
 
-        if es_principal:
-            cursor.execute(
-                "UPDATE propiedades_imagenes SET es_principal = FALSE WHERE propiedad_id = %s;",
-                (propiedad_id,)
-            )
-
         cursor.execute(
             "SELECT COALESCE(MAX(orden), -1) + 1 FROM propiedades_imagenes WHERE propiedad_id = %s;",
             (propiedad_id,)
@@ -771,24 +2911,234 @@ def upload_image(propiedad_id):
 
         image_id = cursor.fetchone()[0]
         conn.commit()
+        mark_dashboard_stats_dirty()
         cursor.close()
 
-        return jsonify({
-            "status": "success",
+        handed_off = schedule_image_derivatives(image_id, unique_filename, local_path)
+
+        return {
             "id": image_id,
             "url": public_url,
             "nombre_archivo": unique_filename,
             "es_principal": es_principal,
             "orden": orden
-        }), 201
+        }
+
+    except Exception:
+        if conn: conn.rollback()
+        if uploaded:
+            try:
+                get_supabase_client().storage.from_(BUCKET_NAME).remove([file_path])
+            except Exception as storage_e:
+                print(f"Error removing orphaned upload {file_path}: {storage_e}")
+        raise
+    finally:
+        if conn:
+            return_db_connection(conn)
+        if not handed_off:
+            try:
+                os.remove(local_path)
+            except OSError:
+                pass
+
+@app.route('/api/propiedades/<int:propiedad_id>/imagenes', methods=['POST'])
+def upload_image(propiedad_id):
+    """Subir una imagen a Supabase Storage y guardar referencia en BD"""
+    if request.content_length and request.content_length > MAX_IMAGE_BYTES + UPLOAD_CHUNK_SIZE:
+        return jsonify({"error": f"File exceeds the {MAX_IMAGE_BYTES // (1024 * 1024)} MB limit"}), 413
+
+    if 'file' not in request.files:
+        return jsonify({"error": "No file provided"}), 400
+
+    file = request.files['file']
+    es_principal = request.form.get('es_principal', 'false').lower() == 'true'
+    run_async = (request.args.get('async') or request.form.get('async', 'false')).lower() in ('1', 'true')
 
+    if file.filename == '':
+        return jsonify({"error": "No file selected"}), 400
+
+    if not allowed_file(file.filename):
+        return jsonify({"error": "File type not allowed"}), 400
+
+    try:
+        file_extension = file.filename.rsplit('.', 1)[1].lower()
+        unique_filename = f"{propiedad_id}_{uuid.uuid4().hex}.{file_extension}"
+        local_path = spool_upload(file)
+
+        if run_async:
+            job_id = submit_upload_job(
+                store_property_image,
+                propiedad_id, local_path, unique_filename, file.content_type, es_principal
+            )
+            return jsonify({
+                "status": "accepted",
+                "job_id": job_id,
+                "status_url": f"/api/propiedades/{propiedad_id}/imagenes/jobs/{job_id}"
+            }), 202
+
+        image = store_property_image(propiedad_id, local_path, unique_filename, file.content_type, es_principal)
+        return jsonify(dict(image, status="success")), 201
+
+    except UploadTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         print(f"Error en upload_image: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/propiedades/<int:propiedad_id>/imagenes/batch', methods=['POST'])
+def upload_images_batch(propiedad_id):
+    """Subir varias imágenes en una sola petición: transferencias concurrentes y un único INSERT"""
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({"error": "No files provided"}), 400
+    if len(files) > IMAGE_BATCH_MAX_FILES:
+        return jsonify({"error": f"Too many files (max {IMAGE_BATCH_MAX_FILES})"}), 400
+
+    try:
+        principal_index = int(request.form['principal_index']) if request.form.get('principal_index') else None
+    except ValueError:
+        return jsonify({"error": "principal_index must be an integer"}), 400
+
+    errors = []
+    pending = []
+    conn = None
+    try:
+        for index, file in enumerate(files):
+            if file.filename == '' or not allowed_file(file.filename):
+                errors.append({"index": index, "filename": file.filename, "error": "File type not allowed"})
+                continue
+            file_extension = file.filename.rsplit('.', 1)[1].lower()
+            unique_filename = f"{propiedad_id}_{uuid.uuid4().hex}.{file_extension}"
+            try:
+                local_path = spool_upload(file)
+            except UploadTooLargeError as e:
+                errors.append({"index": index, "filename": file.filename, "error": str(e)})
+                continue
+            pending.append({
+                "index": index,
+                "filename": file.filename,
+                "nombre_archivo": unique_filename,
+                "file_path": f"propiedades/{unique_filename}",
+                "local_path": local_path,
+                "content_type": file.content_type
+            })
+
+        futures = [
+            (item, get_storage_executor().submit(
+                upload_file_to_storage, item['file_path'], item['local_path'], item['content_type']
+            ))
+            for item in pending
+        ]
+        uploaded = []
+        for item, future in futures:
+            try:
+                item['url'] = future.result()
+                uploaded.append(item)
+            except Exception as e:
+                print(f"Error subiendo {item['filename']} en batch: {e}")
+                errors.append({"index": item['index'], "filename": item['filename'], "error": str(e)})
+
+        if not uploaded:
+            for item in pending:
+                try:
+                    os.remove(item['local_path'])
+                except OSError:
+                    pass
+            return jsonify({"error": "No images were uploaded", "errors": errors}), 400
+    except Exception as e:
+        print(f"Error en upload_images_batch: {e}")
+        for item in pending:
+            try:
+                os.remove(item['local_path'])
+            except OSError:
+                pass
+        return jsonify({"error": str(e)}), 500
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        # Serializes concurrent uploads to the same property while orden is assigned
+        cursor.execute("SELECT id FROM propiedades WHERE id = %s FOR UPDATE;", (propiedad_id,))
+        if not cursor.fetchone():
+            raise LookupError("Propiedad no encontrada")
+
+        has_principal = any(item['index'] == principal_index for item in uploaded)
+        if has_principal:
+            cursor.execute(
+                "UPDATE propiedades_imagenes SET es_principal = FALSE WHERE propiedad_id = %s;",
+                (propiedad_id,)
+            )
+
+        cursor.execute(
+            "SELECT COALESCE(MAX(orden), -1) + 1 FROM propiedades_imagenes WHERE propiedad_id = %s;",
+            (propiedad_id,)
+        )
+        next_orden = cursor.fetchone()[0]
+
+        rows = []
+        for offset, item in enumerate(uploaded):
+            item['orden'] = next_orden + offset
+            item['es_principal'] = item['index'] == principal_index
+            rows.append((propiedad_id, item['url'], item['nombre_archivo'], item['es_principal'], item['orden']))
+
+        inserted = execute_values(
+            cursor,
+            """
+            INSERT INTO propiedades_imagenes (propiedad_id, url, nombre_archivo, es_principal, orden)
+            VALUES %s
+            RETURNING id;
+            """,
+            rows,
+            fetch=True
+        )
+        conn.commit()
+        mark_dashboard_stats_dirty()
+        cursor.close()
+
+        images = [
+            {
+                "id": row[0],
+                "url": item['url'],
+                "nombre_archivo": item['nombre_archivo'],
+                "es_principal": item['es_principal'],
+                "orden": item['orden']
+            }
+            for row, item in zip(inserted, uploaded)
+        ]
+        for image, item in zip(images, uploaded):
+            item['handed_off'] = schedule_image_derivatives(image['id'], item['nombre_archivo'], item['local_path'])
+        return jsonify({"status": "success", "images": images, "errors": errors}), 201
+
+    except Exception as e:
+        print(f"Error en upload_images_batch: {e}")
         if conn: conn.rollback()
+        try:
+            get_supabase_client().storage.from_(BUCKET_NAME).remove([item['file_path'] for item in uploaded])
+        except Exception as storage_e:
+            print(f"Error removing orphaned batch uploads: {storage_e}")
+        if isinstance(e, LookupError):
+            return jsonify({"error": str(e)}), 404
         return jsonify({"error": str(e)}), 500
     finally:
         if conn:
             return_db_connection(conn)
+        for item in pending:
+            if not item.get('handed_off'):
+                try:
+                    os.remove(item['local_path'])
+                except OSError:
+                    pass
+
+@app.route('/api/propiedades/<int:propiedad_id>/imagenes/jobs/<job_id>', methods=['GET'])
+def get_upload_job(propiedad_id, job_id):
+    """Estado de una subida asíncrona (los jobs viven en el worker que los aceptó)"""
+    with _upload_jobs_lock:
+        job = dict(_upload_jobs.get(job_id) or {})
+    if not job:
+        return jsonify({"error": "Job no encontrado"}), 404
+    job.pop('finished_ts', None)
+    return jsonify(job)
 
 @app.route('/api/propiedades/<int:propiedad_id>/imagenes/<int:imagen_id>', methods=['DELETE'])
 def delete_image(propiedad_id, imagen_id):
@@ -810,7 +3160,9 @@ def delete_image(propiedad_id, imagen_id):
 
         file_path = f"propiedades/{imagen['nombre_archivo']}"
         try:
-            get_supabase_client().storage.from_(BUCKET_NAME).remove([file_path])
+            get_supabase_client().storage.from_(BUCKET_NAME).remove(
+                [file_path] + list(derivative_file_paths(imagen['nombre_archivo']).values())
+            )
         except Exception as storage_e:
             print(f"Error deleting from storage (continuing): {storage_e}")
 
@@ -820,6 +3172,7 @@ def delete_image(propiedad_id, imagen_id):
         )
         deleted_rows = cursor.rowcount
         conn.commit()
+        mark_dashboard_stats_dirty()
         cursor.close()
 
         if deleted_rows == 0:
@@ -923,7 +3276,7 @@ def admin_list_users():
 @app.route('/api/admin/users', methods=['POST'])
 def admin_create_user():
     try:
-        requesting_user_id = get_user_id_from_token(request)
+        requesting_user_id = get_user_id_from_token(request, verify_remote=True)
         if not is_admin(requesting_user_id):
             return jsonify({"error": "Admin privileges required"}), 403
 
@@ -953,6 +3306,7 @@ def admin_create_user():
             )
             conn.commit()
             cursor.close()
+            invalidate_user_role(new_user.id)
             profile_set = True
         except Exception as db_error:
              print(f"Error inserting profile for new user {new_user.id}. Attempting to delete auth user. Error: {db_error}")
@@ -980,7 +3334,7 @@ def admin_create_user():
 @app.route('/api/admin/users/<user_id>', methods=['DELETE'])
 def admin_delete_user(user_id):
     try:
-        requesting_user_id = get_user_id_from_token(request)
+        requesting_user_id = get_user_id_from_token(request, verify_remote=True)
         if not is_admin(requesting_user_id):
             return jsonify({"error": "Admin privileges required"}), 403
 
@@ -988,6 +3342,7 @@ def admin_delete_user(user_id):
              return jsonify({"error": "Cannot delete your own admin account"}), 400
 
         get_supabase_admin().auth.admin.delete_user(user_id)
+        invalidate_user_role(user_id)
 
         return jsonify({"status": "success", "message": f"User {user_id} deleted"}), 200
     except Exception as e:
@@ -1003,7 +3358,7 @@ def admin_delete_user(user_id):
 @app.route('/api/admin/users/<user_id>/role', methods=['PUT'])
 def admin_update_user_role(user_id):
     try:
-        requesting_user_id = get_user_id_from_token(request)
+        requesting_user_id = get_user_id_from_token(request, verify_remote=True)
         if not is_admin(requesting_user_id):
             return jsonify({"error": "Admin privileges required"}), 403
 
@@ -1024,6 +3379,7 @@ def admin_update_user_role(user_id):
             updated_rows = cursor.rowcount
             conn.commit()
             cursor.close()
+            invalidate_user_role(user_id)
             if updated_rows == 0:
                  cursor = conn.cursor()
                  cursor.execute("SELECT 1 FROM public.profiles WHERE id = %s", (user_id,))
@@ -1032,6 +3388,7 @@ def admin_update_user_role(user_id):
                      cursor.execute("INSERT INTO public.profiles (id, role) VALUES (%s, %s)", (user_id, new_role))
                      conn.commit()
                      cursor.close()
+                     invalidate_user_role(user_id)
                      return jsonify({"status": "success", "message": f"User {user_id} role created and set to {new_role}"}), 201
                  else:
                     cursor.close()
@@ -1054,6 +3411,38 @@ def admin_update_user_role(user_id):
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
 
+@app.route('/api/admin/slow-queries', methods=['GET', 'DELETE'])
+def admin_slow_queries():
+    """Top-N de consultas lentas de este worker (?limit=, ?sort=max_ms|total_ms|calls); DELETE lo vacía"""
+    try:
+        requesting_user_id = get_user_id_from_token(request)
+        if not is_admin(requesting_user_id):
+            return jsonify({"error": "Admin privileges required"}), 403
+
+        if request.method == 'DELETE':
+            with _slow_queries_lock:
+                _slow_queries.clear()
+            return jsonify({"status": "cleared"}), 200
+
+        sort = request.args.get('sort', 'max_ms')
+        if sort not in ('max_ms', 'total_ms', 'calls'):
+            return jsonify({"error": "sort must be max_ms, total_ms or calls"}), 400
+        try:
+            limit = max(1, min(int(request.args.get('limit', 20)), SLOW_QUERY_MAX_ENTRIES))
+        except ValueError:
+            return jsonify({"error": "limit must be an integer"}), 400
+
+        return jsonify({
+            "threshold_ms": SLOW_QUERY_MS,
+            "pid": os.getpid(),
+            "queries": get_slow_queries(limit, sort)
+        }), 200
+    except Exception as e:
+        print(f"Error listing slow queries: {e}")
+        if "Invalid token" in str(e) or "No token provided" in str(e):
+            return jsonify({"error": str(e)}), 401
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
 # --- Agent Management Endpoints ---
 
 @app.route('/api/agentes', methods=['GET'])
@@ -1216,141 +3605,197 @@ def delete_agente(id):
          return jsonify({"error": f"Internal server error: {str(e)}"}), 500
     
     
-@app.route('/api/dashboard/stats', methods=['GET'])
-def get_dashboard_stats():
-    """Obtiene estadísticas generales del dashboard"""
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        stats = {}
-        
-        cursor.execute("""
-            SELECT COUNT(*) as total 
-            FROM propiedades 
-            WHERE deleted_at IS NULL
-        """)
-        stats['total_propiedades'] = cursor.fetchone()['total']
-        
-        cursor.execute("""
-            SELECT COUNT(*) as total 
-            FROM propiedades p
-            JOIN estados_publicacion ep ON p.estado_publicacion_id = ep.id
-            WHERE p.deleted_at IS NULL 
-            AND ep.nombre ILIKE '%publicad%'
-        """)
-        stats['propiedades_publicadas'] = cursor.fetchone()['total']
-        
-        cursor.execute("""
-            SELECT COALESCE(SUM(visitas), 0) as total 
-            FROM propiedades 
-            WHERE deleted_at IS NULL
-        """)
-        stats['total_visitas'] = cursor.fetchone()['total']
-        
-        cursor.execute("""
+# --- Dashboard Stats Engine ---
+# All dashboard aggregates in a single round trip: live properties are read
+# once (the CTE is materialized), scalar totals use FILTER aggregates and the
+# per-catalog counts come from one GROUPING SETS pass. The GROUPING() bitmask
+# identifies each set: 15 = tipo_negocio, 23 = tipo_propiedad,
+# 27 = estado_publicacion, 29 = ciudad, 30 = captado_por_agente.
+DASHBOARD_STATS_SQL = """
+    WITH live AS (
+        SELECT p.id, p.titulo, p.visitas, p.direccion, p.precio, p.precio_alquiler,
+               p.created_at, p.tipo_negocio_id, p.tipo_propiedad_id,
+               p.estado_publicacion_id, p.ciudad_id, p.captado_por_agente_id,
+               EXISTS (
+                   SELECT 1 FROM propiedades_imagenes pi WHERE pi.propiedad_id = p.id
+               ) AS con_imagen
+        FROM propiedades p
+        WHERE p.deleted_at IS NULL
+    ),
+    totales AS (
+        SELECT
+            COUNT(*) AS total_propiedades,
+            COUNT(*) FILTER (WHERE ep.nombre ILIKE '%publicad%') AS propiedades_publicadas,
+            COALESCE(SUM(l.visitas), 0) AS total_visitas,
+            COUNT(*) FILTER (WHERE l.created_at >= NOW() - INTERVAL '7 days') AS propiedades_nuevas_semana,
+            ROUND(AVG(l.precio), 2) AS precio_promedio_venta,
+            ROUND(AVG(l.precio_alquiler), 2) AS precio_promedio_alquiler,
+            MIN(l.precio) AS precio_min_venta,
+            MAX(l.precio) AS precio_max_venta,
+            MIN(l.precio_alquiler) AS precio_min_alquiler,
+            MAX(l.precio_alquiler) AS precio_max_alquiler,
+            COUNT(*) FILTER (WHERE l.con_imagen) AS con_imagenes,
+            COUNT(*) FILTER (WHERE NOT l.con_imagen) AS sin_imagenes
+        FROM live l
+        LEFT JOIN estados_publicacion ep ON ep.id = l.estado_publicacion_id
+    ),
+    conteos AS (
+        SELECT tipo_negocio_id, tipo_propiedad_id, estado_publicacion_id,
+               ciudad_id, captado_por_agente_id,
+               GROUPING(tipo_negocio_id, tipo_propiedad_id, estado_publicacion_id,
+                        ciudad_id, captado_por_agente_id) AS grupo,
+               COUNT(*) AS cantidad
+        FROM live
+        GROUP BY GROUPING SETS (
+            (tipo_negocio_id), (tipo_propiedad_id), (estado_publicacion_id),
+            (ciudad_id), (captado_por_agente_id)
+        )
+    )
+    SELECT t.*,
+        (SELECT row_to_json(m) FROM (
             SELECT id, titulo, visitas, direccion
-            FROM propiedades 
-            WHERE deleted_at IS NULL AND visitas > 0
-            ORDER BY visitas DESC 
+            FROM live
+            WHERE visitas > 0
+            ORDER BY visitas DESC
             LIMIT 1
-        """)
-        most_visited = cursor.fetchone()
-        stats['propiedad_mas_visitada'] = dict(most_visited) if most_visited else None
-        
-        cursor.execute("""
-            SELECT tn.nombre, COUNT(p.id) as cantidad
-            FROM tipos_negocio tn
-            LEFT JOIN propiedades p ON p.tipo_negocio_id = tn.id AND p.deleted_at IS NULL
-            GROUP BY tn.id, tn.nombre
-            ORDER BY cantidad DESC
-        """)
-        stats['por_tipo_negocio'] = [dict(row) for row in cursor.fetchall()]
-        
-        cursor.execute("""
-            SELECT tp.nombre, COUNT(p.id) as cantidad
-            FROM tipos_propiedad tp
-            LEFT JOIN propiedades p ON p.tipo_propiedad_id = tp.id AND p.deleted_at IS NULL
-            GROUP BY tp.id, tp.nombre
-            ORDER BY cantidad DESC
-        """)
-        stats['por_tipo_propiedad'] = [dict(row) for row in cursor.fetchall()]
-        
-        cursor.execute("""
-            SELECT ep.nombre, COUNT(p.id) as cantidad
-            FROM estados_publicacion ep
-            LEFT JOIN propiedades p ON p.estado_publicacion_id = ep.id AND p.deleted_at IS NULL
-            GROUP BY ep.id, ep.nombre
-            ORDER BY cantidad DESC
-        """)
-        stats['por_estado_publicacion'] = [dict(row) for row in cursor.fetchall()]
-        
-        cursor.execute("""
-            SELECT c.nombre as ciudad, e.nombre as estado, COUNT(p.id) as cantidad
-            FROM ciudades c
-            LEFT JOIN propiedades p ON p.ciudad_id = c.id AND p.deleted_at IS NULL
-            LEFT JOIN estados e ON c.estado_id = e.id
-            GROUP BY c.id, c.nombre, e.nombre
-            HAVING COUNT(p.id) > 0
-            ORDER BY cantidad DESC
+        ) m) AS propiedad_mas_visitada,
+        (SELECT COALESCE(json_agg(json_build_object('nombre', tn.nombre, 'cantidad', COALESCE(c.cantidad, 0))
+                                  ORDER BY COALESCE(c.cantidad, 0) DESC), '[]'::json)
+         FROM tipos_negocio tn
+         LEFT JOIN conteos c ON c.grupo = 15 AND c.tipo_negocio_id = tn.id) AS por_tipo_negocio,
+        (SELECT COALESCE(json_agg(json_build_object('nombre', tp.nombre, 'cantidad', COALESCE(c.cantidad, 0))
+                                  ORDER BY COALESCE(c.cantidad, 0) DESC), '[]'::json)
+         FROM tipos_propiedad tp
+         LEFT JOIN conteos c ON c.grupo = 23 AND c.tipo_propiedad_id = tp.id) AS por_tipo_propiedad,
+        (SELECT COALESCE(json_agg(json_build_object('nombre', ep.nombre, 'cantidad', COALESCE(c.cantidad, 0))
+                                  ORDER BY COALESCE(c.cantidad, 0) DESC), '[]'::json)
+         FROM estados_publicacion ep
+         LEFT JOIN conteos c ON c.grupo = 27 AND c.estado_publicacion_id = ep.id) AS por_estado_publicacion,
+        (SELECT COALESCE(json_agg(row_to_json(tc) ORDER BY tc.cantidad DESC), '[]'::json) FROM (
+            SELECT ci.nombre AS ciudad, e.nombre AS estado, c.cantidad
+            FROM conteos c
+            JOIN ciudades ci ON ci.id = c.ciudad_id
+            LEFT JOIN estados e ON e.id = ci.estado_id
+            WHERE c.grupo = 29
+            ORDER BY c.cantidad DESC
             LIMIT 5
-        """)
-        stats['top_ciudades'] = [dict(row) for row in cursor.fetchall()]
-        
-        cursor.execute("""
-            SELECT a.nombre, a.email, COUNT(p.id) as propiedades_captadas
-            FROM agentes a
-            LEFT JOIN propiedades p ON p.captado_por_agente_id = a.id AND p.deleted_at IS NULL
-            GROUP BY a.id, a.nombre, a.email
-            HAVING COUNT(p.id) > 0
-            ORDER BY propiedades_captadas DESC
+        ) tc) AS top_ciudades,
+        (SELECT COALESCE(json_agg(row_to_json(ta) ORDER BY ta.propiedades_captadas DESC), '[]'::json) FROM (
+            SELECT a.nombre, a.email, c.cantidad AS propiedades_captadas
+            FROM conteos c
+            JOIN agentes a ON a.id = c.captado_por_agente_id
+            WHERE c.grupo = 30
+            ORDER BY c.cantidad DESC
             LIMIT 5
-        """)
-        stats['top_agentes'] = [dict(row) for row in cursor.fetchall()]
-        
-        cursor.execute("""
-            SELECT 
-                ROUND(AVG(precio), 2) as precio_promedio_venta,
-                ROUND(AVG(precio_alquiler), 2) as precio_promedio_alquiler,
-                MIN(precio) as precio_min_venta,
-                MAX(precio) as precio_max_venta,
-                MIN(precio_alquiler) as precio_min_alquiler,
-                MAX(precio_alquiler) as precio_max_alquiler
-            FROM propiedades 
-            WHERE deleted_at IS NULL
-        """)
-        precios = cursor.fetchone()
-        stats['precios'] = dict(precios) if precios else None
-        
-        cursor.execute("""
-            SELECT COUNT(*) as total
-            FROM propiedades 
-            WHERE deleted_at IS NULL 
-            AND created_at >= NOW() - INTERVAL '7 days'
-        """)
-        stats['propiedades_nuevas_semana'] = cursor.fetchone()['total']
-        
-        cursor.execute("""
-            SELECT 
-                COUNT(DISTINCT CASE WHEN pi.id IS NOT NULL THEN p.id END) as con_imagenes,
-                COUNT(DISTINCT CASE WHEN pi.id IS NULL THEN p.id END) as sin_imagenes
-            FROM propiedades p
-            LEFT JOIN propiedades_imagenes pi ON p.id = pi.propiedad_id
-            WHERE p.deleted_at IS NULL
-        """)
-        imagenes_stats = cursor.fetchone()
-        stats['imagenes'] = dict(imagenes_stats) if imagenes_stats else None
-        
-        cursor.close()
-        return jsonify(stats)
+        ) ta) AS top_agentes
+    FROM totales t
+"""
+
+def compute_dashboard_stats(cursor):
+    """Calcula el payload de /api/dashboard/stats en una sola consulta (cursor RealDictCursor)."""
+    cursor.execute(DASHBOARD_STATS_SQL)
+    row = cursor.fetchone()
+
+    return {
+        'total_propiedades': row['total_propiedades'],
+        'propiedades_publicadas': row['propiedades_publicadas'],
+        'total_visitas': row['total_visitas'],
+        'propiedad_mas_visitada': row['propiedad_mas_visitada'],
+        'por_tipo_negocio': row['por_tipo_negocio'],
+        'por_tipo_propiedad': row['por_tipo_propiedad'],
+        'por_estado_publicacion': row['por_estado_publicacion'],
+        'top_ciudades': row['top_ciudades'],
+        'top_agentes': row['top_agentes'],
+        'precios': {
+            'precio_promedio_venta': row['precio_promedio_venta'],
+            'precio_promedio_alquiler': row['precio_promedio_alquiler'],
+            'precio_min_venta': row['precio_min_venta'],
+            'precio_max_venta': row['precio_max_venta'],
+            'precio_min_alquiler': row['precio_min_alquiler'],
+            'precio_max_alquiler': row['precio_max_alquiler'],
+        },
+        'propiedades_nuevas_semana': row['propiedades_nuevas_semana'],
+        'imagenes': {
+            'con_imagenes': row['con_imagenes'],
+            'sin_imagenes': row['sin_imagenes'],
+        },
+    }
+
+# --- Dashboard Snapshot ---
+# The stats only change when a property or image write runs, so the payload
+# is kept precomputed in process. Writes bump the version (mark dirty); the
+# next read recomputes once. DASHBOARD_SNAPSHOT_MAX_AGE bounds how stale a
+# worker can be when the write happened in a different worker.
+DASHBOARD_SNAPSHOT_MAX_AGE = int(os.getenv("DASHBOARD_SNAPSHOT_MAX_AGE", "300"))
+
+_dashboard_snapshot = {"stats": None, "computed_at": None, "computed_ts": 0.0, "version": -1}
+_dashboard_version = 0
+_dashboard_snapshot_lock = threading.Lock()
+_dashboard_refresh_lock = threading.Lock()
+
+def mark_dashboard_stats_dirty():
+    """Invalida el snapshot de estadísticas; se recalcula en la siguiente lectura."""
+    global _dashboard_version
+    with _dashboard_snapshot_lock:
+        _dashboard_version += 1
+
+def _fresh_dashboard_snapshot():
+    with _dashboard_snapshot_lock:
+        snapshot = dict(_dashboard_snapshot)
+        version = _dashboard_version
+    if snapshot['stats'] is None or snapshot['version'] != version:
+        return None
+    if time.time() - snapshot['computed_ts'] > DASHBOARD_SNAPSHOT_MAX_AGE:
+        return None
+    return snapshot
+
+def get_dashboard_snapshot():
+    """Devuelve el snapshot vigente, recalculándolo (una sola vez por worker) si está sucio o caducado."""
+    snapshot = _fresh_dashboard_snapshot()
+    if snapshot:
+        CACHE_REQUESTS_TOTAL.labels(cache='dashboard_snapshot', result='hit').inc()
+        return snapshot
+
+    CACHE_REQUESTS_TOTAL.labels(cache='dashboard_snapshot', result='miss').inc()
+    with _dashboard_refresh_lock:
+        snapshot = _fresh_dashboard_snapshot()
+        if snapshot:
+            return snapshot
+
+        with _dashboard_snapshot_lock:
+            version = _dashboard_version
+
+        conn = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            stats = compute_dashboard_stats(cursor)
+            cursor.close()
+        finally:
+            if conn:
+                return_db_connection(conn)
+
+        computed_at = datetime.utcnow()
+        snapshot = {
+            "stats": stats,
+            "computed_at": computed_at.isoformat(),
+            "computed_ts": time.time(),
+            "version": version
+        }
+        with _dashboard_snapshot_lock:
+            _dashboard_snapshot.update(snapshot)
+        return snapshot
+
+@app.route('/api/dashboard/stats', methods=['GET'])
+def get_dashboard_stats():
+    """Obtiene estadísticas generales del dashboard"""
+    try:
+        snapshot = get_dashboard_snapshot()
+        return jsonify(dict(snapshot['stats'], computed_at=snapshot['computed_at']))
         
     except Exception as e:
         print(f"Error obteniendo estadísticas del dashboard: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        if conn:
-            return_db_connection(conn)
 
 
 @app.route('/api/dashboard/recent-activity', methods=['GET'])
@@ -1396,5 +3841,111 @@ def get_recent_activity():
             return_db_connection(conn)
 
 
+# --- CLI Commands ---
+@app.cli.command('backfill-derivatives')
+@click.option('--batch-size', default=50, show_default=True, help='Imágenes por lote.')
+@click.option('--limit', default=0, help='Máximo de imágenes a procesar (0 = todas).')
+def backfill_derivatives_command(batch_size, limit):
+    """Genera variantes (thumb/medium, JPEG y WebP) para imágenes existentes que no las tienen."""
+    storage = get_supabase_client().storage.from_(BUCKET_NAME)
+    last_id = 0
+    processed = 0
+    failed = 0
+
+    while not limit or processed + failed < limit:
+        conn = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                """
+                SELECT id, nombre_archivo FROM propiedades_imagenes
+                WHERE variantes IS NULL AND id > %s
+                ORDER BY id ASC
+                LIMIT %s;
+                """,
+                (last_id, batch_size)
+            )
+            batch = cursor.fetchall()
+            cursor.close()
+        finally:
+            if conn:
+                return_db_connection(conn)
+
+        if not batch:
+            break
+
+        for imagen in batch:
+            last_id = imagen['id']
+            local_path = None
+            try:
+                fd, local_path = tempfile.mkstemp(prefix='casita_backfill_')
+                with os.fdopen(fd, 'wb') as out:
+                    out.write(storage.download(f"propiedades/{imagen['nombre_archivo']}"))
+                generate_image_derivatives(imagen['id'], imagen['nombre_archivo'], local_path)
+                processed += 1
+            except Exception as e:
+                failed += 1
+                print(f"❌ Imagen {imagen['id']} ({imagen['nombre_archivo']}): {e}")
+            finally:
+                if local_path:
+                    try:
+                        os.remove(local_path)
+                    except OSError:
+                        pass
+            if limit and processed + failed >= limit:
+                break
+
+        print(f"🔄 Procesadas {processed} imágenes ({failed} con error), último id {last_id}")
+
+    print(f"✅ Backfill terminado: {processed} imágenes con variantes, {failed} con error")
+
+
+@app.cli.command('backfill-geohash')
+@click.option('--batch-size', default=1000, show_default=True, help='Propiedades por lote.')
+def backfill_geohash_command(batch_size):
+    """Calcula propiedades.geohash para las filas con coordenadas que aún no lo tienen."""
+    last_id = 0
+    updated = 0
+    while True:
+        conn = None
+        try:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id, lat, lng FROM propiedades
+                WHERE geohash IS NULL AND lat IS NOT NULL AND lng IS NOT NULL AND id > %s
+                ORDER BY id ASC
+                LIMIT %s;
+                """,
+                (last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                cursor.close()
+                break
+            last_id = rows[-1][0]
+            values = [(row_id, property_geohash(lat, lng)) for row_id, lat, lng in rows]
+            values = [value for value in values if value[1]]
+            if values:
+                execute_values(
+                    cursor,
+                    "UPDATE propiedades p SET geohash = v.geohash FROM (VALUES %s) AS v(id, geohash) WHERE p.id = v.id",
+                    values
+                )
+            conn.commit()
+            cursor.close()
+            updated += len(values)
+            print(f"🔄 {updated} propiedades con geohash, último id {last_id}")
+        except Exception:
+            if conn: conn.rollback()
+            raise
+        finally:
+            if conn:
+                return_db_connection(conn)
+    print(f"✅ Backfill de geohash terminado: {updated} propiedades actualizadas")
+
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
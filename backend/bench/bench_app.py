@@ -0,0 +1,24 @@
+"""
+WSGI entry point for benchmarks: the real app with Supabase stubbed out.
+
+    gunicorn -c gunicorn.conf.py --pythonpath bench bench_app:app
+
+Database settings come from the usual environment (DB_USER, PASSWORD, HOST,
+DB_PORT, DBNAME, DB_SSLMODE). Tokens are verified locally with
+BENCH_JWT_SECRET; BENCH_STUB_LATENCY_MS delays every stubbed Supabase call.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stubs
+
+os.environ['SUPABASE_JWT_SECRET'] = stubs.BENCH_JWT_SECRET
+os.environ.setdefault('REQUEST_TIMING_LOG', '0')
+
+import app as app_module
+
+stubs.install(app_module, float(os.getenv('BENCH_STUB_LATENCY_MS', '0')))
+app = app_module.app
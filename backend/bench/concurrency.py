@@ -0,0 +1,92 @@
+"""
+Throughput vs. concurrent clients for each gunicorn worker mode.
+
+Starts gunicorn (backend/gunicorn.conf.py) once per mode with bench_app: the
+real app against the benchmark database, with the Supabase stubs answering
+after --stub-latency-ms. That delay is the I/O wait a sync worker serialises
+and gthread/gevent overlap, so the default request mix includes a login (one
+Supabase Auth round trip, no DB) next to the DB-backed list and catalogs.
+Each mode is driven with 1, 2, 4, ... closed-loop clients and requests/s
+and latency percentiles are printed per level:
+
+    cd backend
+    export DBNAME=casita_bench DB_SSLMODE=disable ...   # app DB variables
+    python bench/concurrency.py --modes sync,gthread,gevent --levels 1,2,4,8,16
+
+Use --url to benchmark an already running server instead.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from loadgen import run_load, wait_until_up
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_REQUESTS = [
+    '/api/propiedades?limit=20&fields=card',
+    '/api/catalogos',
+    {'method': 'POST', 'path': '/api/login', 'headers': {'Content-Type': 'application/json'},
+     'body': json.dumps({'email': 'bench-admin@example.com', 'password': 'bench'}).encode()},
+]
+
+
+def start_gunicorn(mode, port, threads, stub_latency_ms):
+    # No max_requests recycling: a worker restart mid-run would dominate p99
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=mode, GUNICORN_THREADS=str(threads),
+               GUNICORN_MAX_REQUESTS='0', PORT=str(port), BENCH_STUB_LATENCY_MS=str(stub_latency_ms))
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--pythonpath', 'bench', 'bench_app:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def print_table(mode, rows):
+    print(f"\n== {mode} ==")
+    print(f"{'clients':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}  statuses")
+    for row in rows:
+        print(f"{row['concurrency']:>8} {row['rps']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+              f"{row['p99_ms']:>9} {row['errors']:>7}  {row['statuses']}")
+
+
+def bench(base_url, paths, levels, duration):
+    run_load(base_url, paths, 1, 1)  # warm-up: pool connections, prepared statements
+    return [run_load(base_url, paths, level, duration) for level in levels]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', default='sync,gthread', help='comma-separated worker classes')
+    parser.add_argument('--levels', default='1,2,4,8,16', help='comma-separated client counts')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per level')
+    parser.add_argument('--threads', type=int, default=8, help='GUNICORN_THREADS for gthread')
+    parser.add_argument('--stub-latency-ms', type=float, default=50,
+                        help='delay of every stubbed Supabase call (the I/O wait workers overlap)')
+    parser.add_argument('--port', type=int, default=10100)
+    parser.add_argument('--path', action='append', dest='paths', help='GET request path (repeatable)')
+    parser.add_argument('--url', help='benchmark this running server instead of starting gunicorn')
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(',')]
+    paths = args.paths or DEFAULT_REQUESTS
+
+    if args.url:
+        print_table(args.url, bench(args.url.rstrip('/'), paths, levels, args.duration))
+        return
+
+    for mode in args.modes.split(','):
+        server = start_gunicorn(mode, args.port, args.threads, args.stub_latency_ms)
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            wait_until_up(base_url + '/readyz')
+            print_table(mode, bench(base_url, paths, levels, args.duration))
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=60)
+
+
+if __name__ == '__main__':
+    main()
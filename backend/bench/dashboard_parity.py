@@ -0,0 +1,225 @@
+"""
+Parity check for /api/dashboard/stats.
+
+Runs the original twelve dashboard queries and compute_dashboard_stats()
+against the same database snapshot and compares the two payloads key by key
+after JSON serialisation (what the endpoint actually returns):
+
+    cd backend
+    export DBNAME=casita_bench DB_SSLMODE=disable ...   # app DB variables
+    python bench/seed.py --scale 10000
+    python bench/dashboard_parity.py
+
+Ranked lists (top ciudades/agentes, propiedad más visitada) are compared
+tie-aware: neither query orders rows with equal counts, so only rows whose
+count ties at the cut-off may differ. Exits 1 on any mismatch.
+"""
+import json
+import os
+import sys
+
+from psycopg2.extras import RealDictCursor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_app import app_module
+from seed import connect
+
+
+def legacy_dashboard_stats(cursor):
+    """The per-metric queries get_dashboard_stats ran before the single GROUPING SETS query."""
+    stats = {}
+
+    cursor.execute("""
+        SELECT COUNT(*) as total
+        FROM propiedades
+        WHERE deleted_at IS NULL
+    """)
+    stats['total_propiedades'] = cursor.fetchone()['total']
+
+    cursor.execute("""
+        SELECT COUNT(*) as total
+        FROM propiedades p
+        JOIN estados_publicacion ep ON p.estado_publicacion_id = ep.id
+        WHERE p.deleted_at IS NULL
+        AND ep.nombre ILIKE '%publicad%'
+    """)
+    stats['propiedades_publicadas'] = cursor.fetchone()['total']
+
+    cursor.execute("""
+        SELECT COALESCE(SUM(visitas), 0) as total
+        FROM propiedades
+        WHERE deleted_at IS NULL
+    """)
+    stats['total_visitas'] = cursor.fetchone()['total']
+
+    cursor.execute("""
+        SELECT id, titulo, visitas, direccion
+        FROM propiedades
+        WHERE deleted_at IS NULL AND visitas > 0
+        ORDER BY visitas DESC
+        LIMIT 1
+    """)
+    most_visited = cursor.fetchone()
+    stats['propiedad_mas_visitada'] = dict(most_visited) if most_visited else None
+
+    cursor.execute("""
+        SELECT tn.nombre, COUNT(p.id) as cantidad
+        FROM tipos_negocio tn
+        LEFT JOIN propiedades p ON p.tipo_negocio_id = tn.id AND p.deleted_at IS NULL
+        GROUP BY tn.id, tn.nombre
+        ORDER BY cantidad DESC
+    """)
+    stats['por_tipo_negocio'] = [dict(row) for row in cursor.fetchall()]
+
+    cursor.execute("""
+        SELECT tp.nombre, COUNT(p.id) as cantidad
+        FROM tipos_propiedad tp
+        LEFT JOIN propiedades p ON p.tipo_propiedad_id = tp.id AND p.deleted_at IS NULL
+        GROUP BY tp.id, tp.nombre
+        ORDER BY cantidad DESC
+    """)
+    stats['por_tipo_propiedad'] = [dict(row) for row in cursor.fetchall()]
+
+    cursor.execute("""
+        SELECT ep.nombre, COUNT(p.id) as cantidad
+        FROM estados_publicacion ep
+        LEFT JOIN propiedades p ON p.estado_publicacion_id = ep.id AND p.deleted_at IS NULL
+        GROUP BY ep.id, ep.nombre
+        ORDER BY cantidad DESC
+    """)
+    stats['por_estado_publicacion'] = [dict(row) for row in cursor.fetchall()]
+
+    cursor.execute("""
+        SELECT c.nombre as ciudad, e.nombre as estado, COUNT(p.id) as cantidad
+        FROM ciudades c
+        LEFT JOIN propiedades p ON p.ciudad_id = c.id AND p.deleted_at IS NULL
+        LEFT JOIN estados e ON c.estado_id = e.id
+        GROUP BY c.id, c.nombre, e.nombre
+        HAVING COUNT(p.id) > 0
+        ORDER BY cantidad DESC
+        LIMIT 5
+    """)
+    stats['top_ciudades'] = [dict(row) for row in cursor.fetchall()]
+
+    cursor.execute("""
+        SELECT a.nombre, a.email, COUNT(p.id) as propiedades_captadas
+        FROM agentes a
+        LEFT JOIN propiedades p ON p.captado_por_agente_id = a.id AND p.deleted_at IS NULL
+        GROUP BY a.id, a.nombre, a.email
+        HAVING COUNT(p.id) > 0
+        ORDER BY propiedades_captadas DESC
+        LIMIT 5
+    """)
+    stats['top_agentes'] = [dict(row) for row in cursor.fetchall()]
+
+    cursor.execute("""
+        SELECT
+            ROUND(AVG(precio), 2) as precio_promedio_venta,
+            ROUND(AVG(precio_alquiler), 2) as precio_promedio_alquiler,
+            MIN(precio) as precio_min_venta,
+            MAX(precio) as precio_max_venta,
+            MIN(precio_alquiler) as precio_min_alquiler,
+            MAX(precio_alquiler) as precio_max_alquiler
+        FROM propiedades
+        WHERE deleted_at IS NULL
+    """)
+    precios = cursor.fetchone()
+    stats['precios'] = dict(precios) if precios else None
+
+    cursor.execute("""
+        SELECT COUNT(*) as total
+        FROM propiedades
+        WHERE deleted_at IS NULL
+        AND created_at >= NOW() - INTERVAL '7 days'
+    """)
+    stats['propiedades_nuevas_semana'] = cursor.fetchone()['total']
+
+    cursor.execute("""
+        SELECT
+            COUNT(DISTINCT CASE WHEN pi.id IS NOT NULL THEN p.id END) as con_imagenes,
+            COUNT(DISTINCT CASE WHEN pi.id IS NULL THEN p.id END) as sin_imagenes
+        FROM propiedades p
+        LEFT JOIN propiedades_imagenes pi ON p.id = pi.propiedad_id
+        WHERE p.deleted_at IS NULL
+    """)
+    imagenes_stats = cursor.fetchone()
+    stats['imagenes'] = dict(imagenes_stats) if imagenes_stats else None
+
+    return stats
+
+
+def as_json(stats):
+    return json.loads(app_module.app.json.dumps(stats))
+
+
+def canonical(rows):
+    return sorted(json.dumps(row, sort_keys=True) for row in rows)
+
+
+def compare_ranked(key, legacy, new, count_key):
+    """Same length and counts; rows above the cut-off count must match exactly."""
+    errors = []
+    if [row[count_key] for row in legacy] != [row[count_key] for row in new]:
+        return [f"{key}: counts differ\n   legacy: {legacy}\n   new:    {new}"]
+    if not legacy:
+        return errors
+    cutoff = legacy[-1][count_key]
+    above_legacy = [row for row in legacy if row[count_key] > cutoff]
+    above_new = [row for row in new if row[count_key] > cutoff]
+    if canonical(above_legacy) != canonical(above_new):
+        errors.append(f"{key}: rows differ\n   legacy: {legacy}\n   new:    {new}")
+    if any(set(row) != set(legacy[0]) for row in new):
+        errors.append(f"{key}: row keys differ: {sorted(legacy[0])} vs {sorted(new[0])}")
+    return errors
+
+
+def compare(legacy, new):
+    errors = []
+    if set(legacy) != set(new):
+        errors.append(f"top-level keys differ: only legacy {sorted(set(legacy) - set(new))}, "
+                      f"only new {sorted(set(new) - set(legacy))}")
+
+    for key in sorted(set(legacy) & set(new)):
+        old_value, new_value = legacy[key], new[key]
+        if key in ('por_tipo_negocio', 'por_tipo_propiedad', 'por_estado_publicacion'):
+            if canonical(old_value) != canonical(new_value):
+                errors.append(f"{key}: {old_value} != {new_value}")
+        elif key == 'top_ciudades':
+            errors.extend(compare_ranked(key, old_value, new_value, 'cantidad'))
+        elif key == 'top_agentes':
+            errors.extend(compare_ranked(key, old_value, new_value, 'propiedades_captadas'))
+        elif key == 'propiedad_mas_visitada':
+            errors.extend(compare_ranked(key, [old_value] if old_value else [],
+                                         [new_value] if new_value else [], 'visitas'))
+        elif old_value != new_value:
+            errors.append(f"{key}: {old_value!r} != {new_value!r}")
+    return errors
+
+
+def main():
+    conn = connect()
+    try:
+        # One REPEATABLE READ transaction: both sides see the same snapshot.
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        legacy = as_json(legacy_dashboard_stats(cursor))
+        new = as_json(app_module.compute_dashboard_stats(cursor))
+        cursor.close()
+        conn.rollback()
+    finally:
+        conn.close()
+
+    errors = compare(legacy, new)
+    if errors:
+        print("❌ Dashboard stats differ from the legacy queries:")
+        for error in errors:
+            print(f" - {error}")
+        sys.exit(1)
+    print(f"✅ Dashboard stats match the legacy queries ({len(legacy)} keys, "
+          f"{legacy['total_propiedades']} propiedades)")
+
+
+if __name__ == '__main__':
+    main()
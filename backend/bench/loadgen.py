@@ -0,0 +1,120 @@
+"""
+Closed-loop HTTP load generator (stdlib only).
+
+Each simulated client is a thread with its own keep-alive connection that
+sends its next request as soon as the previous one completes, so the
+offered load is exactly `concurrency` requests in flight.
+"""
+import http.client
+import itertools
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+
+def percentile(sorted_values, pct):
+    """Percentil por el método nearest-rank sobre una lista ya ordenada."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def wait_until_up(url, timeout=60):
+    """Espera a que `url` responda 2xx. Lanza RuntimeError si no lo hace a tiempo."""
+    deadline = time.time() + timeout
+    last_error = None
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as response:
+                if 200 <= response.status < 300:
+                    return
+        except Exception as e:
+            last_error = e
+        time.sleep(0.25)
+    raise RuntimeError(f"{url} not up after {timeout}s: {last_error}")
+
+
+def _request_spec(spec, headers):
+    """(method, path, body, headers) de un path (GET) o de un dict {method, path, body, headers}."""
+    if isinstance(spec, str):
+        return 'GET', spec, None, headers
+    merged = dict(headers)
+    merged.update(spec.get('headers') or {})
+    return spec.get('method', 'GET'), spec['path'], spec.get('body'), merged
+
+
+def _client(base, paths, headers, stop_at, results, lock):
+    parsed = urllib.parse.urlsplit(base)
+    conn_cls = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+    conn = conn_cls(parsed.hostname, parsed.port, timeout=60)
+    latencies = []
+    statuses = {}
+    errors = 0
+    reused = False
+    for spec in itertools.cycle(paths):
+        if time.monotonic() >= stop_at:
+            break
+        method, path, body, request_headers = _request_spec(spec, headers)
+        started = time.monotonic()
+        for attempt in (1, 2):
+            try:
+                conn.request(method, path, body=body, headers=request_headers)
+                response = conn.getresponse()
+                response.read()
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                latencies.append((time.monotonic() - started) * 1000)
+                reused = True
+                break
+            except Exception:
+                conn.close()
+                conn = conn_cls(parsed.hostname, parsed.port, timeout=60)
+                # A keep-alive connection the server already closed is
+                # retried once on a fresh socket, like any HTTP client does.
+                if not (reused and attempt == 1):
+                    errors += 1
+                    break
+                reused = False
+    conn.close()
+    with lock:
+        results['latencies'].extend(latencies)
+        results['errors'] += errors
+        for status, count in statuses.items():
+            results['statuses'][status] = results['statuses'].get(status, 0) + count
+
+
+def run_load(base_url, paths, concurrency, duration, headers=None):
+    """
+    Lanza `concurrency` clientes contra `paths` (rotando) durante `duration` segundos.
+    Cada elemento es un path (GET) o un dict {method, path, body, headers}.
+    Devuelve requests, errors, statuses, rps y latencias mean/p50/p95/p99 en ms.
+    """
+    if isinstance(paths, (str, dict)):
+        paths = [paths]
+    results = {'latencies': [], 'errors': 0, 'statuses': {}}
+    lock = threading.Lock()
+    started = time.monotonic()
+    stop_at = started + duration
+    clients = [
+        threading.Thread(target=_client, args=(base_url, paths, headers or {}, stop_at, results, lock), daemon=True)
+        for _ in range(concurrency)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.monotonic() - started
+
+    latencies = sorted(results['latencies'])
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': results['errors'],
+        'statuses': results['statuses'],
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+    }
@@ -0,0 +1,223 @@
+"""
+Benchmark suite: latency percentiles and throughput for the main endpoints.
+
+Starts gunicorn with bench_app (the real app, Supabase stubbed) against the
+benchmark database, runs each scenario for --duration seconds with
+--concurrency closed-loop clients, prints p50/p95/p99 and req/s, writes the
+results to bench/results/ and compares them with the stored baseline:
+
+    cd backend
+    export DBNAME=casita_bench DB_SSLMODE=disable ...   # app DB variables
+    python bench/run.py --scale 10000 --seed-db         # seed, then measure
+    python bench/run.py --scale 10000 --save-baseline   # record the baseline
+    python bench/run.py --scale 10000 --fail-on-regression
+
+Scenarios: list, detail, catalogos, dashboard, upload (--scenarios to pick).
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+import jwt
+from PIL import Image
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, BENCH_DIR)
+
+from loadgen import run_load, wait_until_up
+from seed import connect
+from stubs import BENCH_ADMIN_EMAIL, BENCH_ADMIN_ID, BENCH_JWT_SECRET
+
+SCENARIOS = ('list', 'detail', 'catalogos', 'dashboard', 'upload')
+COMPARED_METRICS = ('rps', 'p50_ms', 'p95_ms', 'p99_ms')
+
+
+def admin_token():
+    claims = {'sub': BENCH_ADMIN_ID, 'email': BENCH_ADMIN_EMAIL, 'aud': 'authenticated',
+              'role': 'authenticated', 'exp': int(time.time()) + 24 * 3600}
+    return jwt.encode(claims, BENCH_JWT_SECRET, algorithm='HS256')
+
+
+def multipart_image(width=1024, height=768):
+    """Cuerpo multipart/form-data con un JPEG de prueba. Devuelve (body, content_type)."""
+    image = io.BytesIO()
+    Image.new('RGB', (width, height), (90, 140, 200)).save(image, 'JPEG', quality=85)
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"bench.jpg\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + image.getvalue() + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def sample_property_ids(count=500):
+    """Ids de propiedades no borradas, en un orden aleatorio pero repetible."""
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT setseed(0.42)")
+        cursor.execute("SELECT id FROM propiedades WHERE deleted_at IS NULL ORDER BY random() LIMIT %s", (count,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def build_scenarios(names):
+    """Peticiones de cada escenario; las de detalle/subida rotan sobre ids del seed."""
+    ids = sample_property_ids()
+    scenarios = {
+        'list': ['/api/propiedades?limit=20', '/api/propiedades?limit=20&fields=card'],
+        'detail': [f"/api/propiedades/{propiedad_id}" for propiedad_id in ids],
+        'catalogos': ['/api/catalogos'],
+        'dashboard': ['/api/dashboard/stats'],
+    }
+    if 'upload' in names:
+        body, content_type = multipart_image()
+        scenarios['upload'] = [
+            {'method': 'POST', 'path': f"/api/propiedades/{propiedad_id}/imagenes", 'body': body,
+             'headers': {'Content-Type': content_type}}
+            for propiedad_id in ids[:50]
+        ]
+    return {name: scenarios[name] for name in names}
+
+
+def start_server(port, worker_class, threads, stub_latency_ms):
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKER_CLASS=worker_class, GUNICORN_THREADS=str(threads),
+               GUNICORN_MAX_REQUESTS='0', BENCH_STUB_LATENCY_MS=str(stub_latency_ms))
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--pythonpath', 'bench', 'bench_app:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Imprime la variación frente al baseline. Devuelve la lista de regresiones."""
+    regressions = []
+    print(f"\nvs. baseline {baseline['meta'].get('git_commit')} ({baseline['meta'].get('timestamp')})")
+    print(f"{'scenario':<11}" + "".join(f"{metric:>16}" for metric in COMPARED_METRICS))
+    for name, stats in results['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if not base:
+            continue
+        cells = []
+        for metric in COMPARED_METRICS:
+            change = (stats[metric] - base[metric]) / base[metric] * 100 if base[metric] else 0.0
+            # Lower is better for latency, higher is better for throughput
+            worse = -change if metric == 'rps' else change
+            flag = ' !' if worse > threshold else '  '
+            if worse > threshold:
+                regressions.append(f"{name} {metric} {change:+.1f}%")
+            cells.append(f"{change:+13.1f}%{flag}")
+        print(f"{name:<11}" + "".join(cells))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=1000,
+                        help='properties in the benchmark database (labels the results and baseline)')
+    parser.add_argument('--seed-db', action='store_true', help='(re)seed the database at --scale first')
+    parser.add_argument('--skip-migration', action='append', default=[], metavar='PREFIX',
+                        help='passed to seed.py with --seed-db')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=15, help='seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of warm-up per scenario')
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--stub-latency-ms', type=float, default=0,
+                        help='delay added to every stubbed Supabase call')
+    parser.add_argument('--port', type=int, default=10300)
+    parser.add_argument('--baseline', help='baseline JSON (default: results/baseline-<scale>.json)')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--threshold', type=float, default=10, help='regression threshold in percent')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    names = [name for name in args.scenarios.split(',') if name]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.seed_db:
+        from seed import seed
+        seed(args.scale, skip_migrations=args.skip_migration)
+
+    scenarios = build_scenarios(names)
+    headers = {'Authorization': f"Bearer {admin_token()}"}
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'git_commit': git_commit(),
+            'scale': args.scale,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'worker_class': args.worker_class,
+            'threads': args.threads,
+            'stub_latency_ms': args.stub_latency_ms,
+            'python': platform.python_version(),
+            'host': platform.node(),
+        },
+        'scenarios': {}
+    }
+
+    server = start_server(args.port, args.worker_class, args.threads, args.stub_latency_ms)
+    try:
+        wait_until_up(base_url + '/readyz')
+        print(f"{'scenario':<11}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}  statuses")
+        for name, requests in scenarios.items():
+            if args.warmup:
+                run_load(base_url, requests, args.concurrency, args.warmup, headers)
+            stats = run_load(base_url, requests, args.concurrency, args.duration, headers)
+            results['scenarios'][name] = stats
+            print(f"{name:<11}{stats['rps']:>9}{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+                  f"{stats['errors']:>8}  {stats['statuses']}")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime())
+    result_path = os.path.join(RESULTS_DIR, f"{args.scale}-{stamp}.json")
+    with open(result_path, 'w') as fh:
+        json.dump(results, fh, indent=2)
+    print(f"\n📄 {result_path}")
+
+    baseline_path = args.baseline or os.path.join(RESULTS_DIR, f"baseline-{args.scale}.json")
+    if args.save_baseline:
+        with open(baseline_path, 'w') as fh:
+            json.dump(results, fh, indent=2)
+        print(f"📌 Baseline guardado en {baseline_path}")
+        return
+
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as fh:
+            regressions = compare(results, json.load(fh), args.threshold)
+        if regressions:
+            print(f"\n⚠️  Regresiones > {args.threshold}%: {'; '.join(regressions)}")
+            if args.fail_on_regression:
+                sys.exit(1)
+    else:
+        print(f"(sin baseline en {baseline_path}; usa --save-baseline)")
+
+
+if __name__ == '__main__':
+    main()
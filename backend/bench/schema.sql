@@ -0,0 +1,88 @@
+-- Baseline schema for the benchmark database: the tables the API reads and
+-- writes, as they exist before backend/migrations/ is applied. seed.py runs
+-- this, then every migration in order, then loads the data.
+-- Destructive: only point it at a throwaway database.
+
+DROP SCHEMA IF EXISTS auth CASCADE;
+DROP TABLE IF EXISTS public.propiedades_imagenes, public.propiedades, public.profiles,
+    public.ciudades, public.estados, public.zonas, public.agentes, public.agentes_externos,
+    public.estados_fisicos, public.estados_publicacion, public.frecuencias_alquiler,
+    public.monedas, public.tipos_negocio, public.tipos_propiedad CASCADE;
+
+CREATE SCHEMA auth;
+CREATE TABLE auth.users (
+    id uuid PRIMARY KEY,
+    email text,
+    created_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE public.profiles (
+    id uuid PRIMARY KEY REFERENCES auth.users (id) ON DELETE CASCADE,
+    role text DEFAULT 'user'
+);
+
+CREATE TABLE public.estados (id serial PRIMARY KEY, nombre text NOT NULL);
+CREATE TABLE public.ciudades (id serial PRIMARY KEY, nombre text NOT NULL, estado_id int REFERENCES public.estados (id));
+CREATE TABLE public.zonas (id serial PRIMARY KEY, nombre text NOT NULL);
+CREATE TABLE public.agentes (id serial PRIMARY KEY, nombre text NOT NULL, email text UNIQUE, telefono text);
+CREATE TABLE public.agentes_externos (id serial PRIMARY KEY, nombre text NOT NULL);
+CREATE TABLE public.estados_fisicos (id serial PRIMARY KEY, nombre text NOT NULL);
+CREATE TABLE public.estados_publicacion (id serial PRIMARY KEY, nombre text NOT NULL);
+CREATE TABLE public.frecuencias_alquiler (id serial PRIMARY KEY, nombre text NOT NULL);
+CREATE TABLE public.monedas (id serial PRIMARY KEY, nombre text NOT NULL);
+CREATE TABLE public.tipos_negocio (id serial PRIMARY KEY, nombre text NOT NULL);
+CREATE TABLE public.tipos_propiedad (id serial PRIMARY KEY, nombre text NOT NULL);
+
+CREATE TABLE public.propiedades (
+    id serial PRIMARY KEY,
+    titulo text NOT NULL,
+    descripcion text,
+    precio numeric(14, 2),
+    precio_alquiler numeric(14, 2),
+    valor_administracion numeric(14, 2),
+    habitaciones int DEFAULT 0,
+    alcobas int DEFAULT 0,
+    banos int DEFAULT 0,
+    banos_medios int DEFAULT 0,
+    estacionamientos int DEFAULT 0,
+    anio_construccion int,
+    piso text,
+    m2_terreno numeric DEFAULT 0,
+    m2_construccion numeric DEFAULT 0,
+    m2_privada numeric DEFAULT 0,
+    direccion text,
+    codigo_postal text,
+    lat numeric(10, 7),
+    lng numeric(10, 7),
+    visitas int DEFAULT 0,
+    registro_publico text,
+    convenio_url text,
+    convenio_validado boolean DEFAULT false,
+    fecha_validacion timestamptz,
+    created_at timestamptz DEFAULT now(),
+    updated_at timestamptz,
+    deleted_at timestamptz,
+    tipo_negocio_id int REFERENCES public.tipos_negocio (id),
+    tipo_propiedad_id int REFERENCES public.tipos_propiedad (id),
+    estado_publicacion_id int REFERENCES public.estados_publicacion (id),
+    captado_por_agente_id int REFERENCES public.agentes (id),
+    moneda_id int REFERENCES public.monedas (id),
+    frecuencia_alquiler_id int REFERENCES public.frecuencias_alquiler (id),
+    estado_fisico_id int REFERENCES public.estados_fisicos (id),
+    estado_id int REFERENCES public.estados (id),
+    ciudad_id int REFERENCES public.ciudades (id),
+    zona_id int REFERENCES public.zonas (id),
+    agente_id int REFERENCES public.agentes (id),
+    agente_externo_id int REFERENCES public.agentes_externos (id),
+    validado_por_usuario_id int
+);
+
+CREATE TABLE public.propiedades_imagenes (
+    id serial PRIMARY KEY,
+    propiedad_id int NOT NULL REFERENCES public.propiedades (id) ON DELETE CASCADE,
+    url text NOT NULL,
+    nombre_archivo text,
+    es_principal boolean DEFAULT false,
+    orden int DEFAULT 0,
+    created_at timestamptz DEFAULT now()
+);
@@ -0,0 +1,200 @@
+"""
+Create and seed the benchmark database.
+
+Drops and recreates the API tables (schema.sql), applies every
+backend/migrations/*.sql in order and loads a deterministic data set:
+catalogs, an admin profile and `--scale` properties with 0-5 images each.
+
+    cd backend
+    DBNAME=casita_bench python bench/seed.py --scale 10000
+
+Uses the app's connection variables (DB_USER, PASSWORD, HOST, DB_PORT,
+DBNAME, DB_SSLMODE). Never point it at a real database.
+"""
+import argparse
+import csv
+import glob
+import io
+import os
+import random
+import sys
+import time
+
+import psycopg2
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stubs import BENCH_ADMIN_EMAIL, BENCH_ADMIN_ID
+
+COPY_CHUNK = 10000
+
+CATALOGS = {
+    'estados': ['Jalisco', 'Ciudad de México', 'Nuevo León', 'Querétaro', 'Yucatán', 'Puebla', 'Guanajuato', 'Quintana Roo'],
+    'zonas': [f"Zona {name}" for name in ('Centro', 'Norte', 'Sur', 'Oriente', 'Poniente', 'Industrial', 'Residencial',
+                                          'Campestre', 'Costera', 'Universitaria')],
+    'agentes_externos': [f"Inmobiliaria {number}" for number in range(1, 11)],
+    'estados_fisicos': ['Nuevo', 'Excelente', 'Bueno', 'Para remodelar'],
+    'estados_publicacion': ['Publicada', 'Borrador', 'Vendida', 'Rentada'],
+    'frecuencias_alquiler': ['Mensual', 'Semanal', 'Anual'],
+    'monedas': ['MXN', 'USD'],
+    'tipos_negocio': ['Venta', 'Renta'],
+    'tipos_propiedad': ['Casa', 'Departamento', 'Terreno', 'Local comercial', 'Oficina', 'Bodega'],
+}
+# (ciudad, estado_id, lat, lng)
+CITIES = [
+    ('Guadalajara', 1, 20.6597, -103.3496), ('Zapopan', 1, 20.7214, -103.3918),
+    ('Tlaquepaque', 1, 20.6409, -103.2933), ('Coyoacán', 2, 19.3467, -99.1617),
+    ('Benito Juárez', 2, 19.3720, -99.1580), ('Monterrey', 3, 25.6866, -100.3161),
+    ('San Pedro Garza García', 3, 25.6573, -100.4025), ('Querétaro', 4, 20.5888, -100.3899),
+    ('Mérida', 5, 20.9674, -89.5926), ('Puebla', 6, 19.0414, -98.2063),
+    ('León', 7, 21.1250, -101.6860), ('Cancún', 8, 21.1619, -86.8515),
+]
+WORDS = ['amplia', 'iluminada', 'remodelada', 'jardín', 'alberca', 'terraza', 'vista', 'cocina integral',
+         'seguridad', 'estacionamiento', 'cerca de escuelas', 'coto privado', 'roof garden', 'bodega']
+
+PROPERTY_COPY_COLUMNS = (
+    'titulo', 'descripcion', 'precio', 'precio_alquiler', 'habitaciones', 'alcobas', 'banos',
+    'estacionamientos', 'anio_construccion', 'm2_terreno', 'm2_construccion', 'direccion',
+    'codigo_postal', 'lat', 'lng', 'geohash', 'visitas', 'convenio_validado', 'tipo_negocio_id',
+    'tipo_propiedad_id', 'estado_publicacion_id', 'captado_por_agente_id', 'moneda_id',
+    'frecuencia_alquiler_id', 'estado_fisico_id', 'estado_id', 'ciudad_id', 'zona_id', 'agente_id',
+    'created_at', 'updated_at', 'deleted_at'
+)
+
+
+def connect():
+    return psycopg2.connect(
+        user=os.getenv('DB_USER'), password=os.getenv('PASSWORD'), host=os.getenv('HOST'),
+        port=os.getenv('DB_PORT', '5432'), dbname=os.getenv('DBNAME'),
+        sslmode=os.getenv('DB_SSLMODE', 'prefer')
+    )
+
+
+def apply_schema(cursor, skip_migrations):
+    with open(os.path.join(BENCH_DIR, 'schema.sql')) as fh:
+        cursor.execute(fh.read())
+    for path in sorted(glob.glob(os.path.join(BACKEND_DIR, 'migrations', '*.sql'))):
+        name = os.path.basename(path)
+        if any(name.startswith(prefix) for prefix in skip_migrations):
+            print(f"   skip {name}")
+            continue
+        print(f"   apply {name}")
+        with open(path) as fh:
+            cursor.execute(fh.read())
+
+
+def copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def seed_catalogs(cursor):
+    for table, names in CATALOGS.items():
+        copy_rows(cursor, f"public.{table}", ('nombre',), [(name,) for name in names])
+    copy_rows(cursor, 'public.ciudades', ('nombre', 'estado_id'), [(city[0], city[1]) for city in CITIES])
+    copy_rows(cursor, 'public.agentes', ('nombre', 'email', 'telefono'),
+              [(f"Agente {number}", f"agente{number}@example.com", f"33{number:08d}") for number in range(1, 26)])
+
+    users = [(BENCH_ADMIN_ID, BENCH_ADMIN_EMAIL)] + [
+        (f"00000000-0000-4000-8000-{number:012d}", f"user{number}@example.com") for number in range(2, 52)]
+    copy_rows(cursor, 'auth.users', ('id', 'email'), users)
+    copy_rows(cursor, 'public.profiles', ('id', 'role'),
+              [(user_id, 'admin' if user_id == BENCH_ADMIN_ID else 'user') for user_id, _ in users])
+
+
+def generate_properties(rng, scale, property_geohash):
+    now = time.time()
+    for number in range(1, scale + 1):
+        city_id = rng.randrange(len(CITIES))
+        city, estado_id, lat, lng = CITIES[city_id]
+        lat = round(lat + rng.uniform(-0.15, 0.15), 7)
+        lng = round(lng + rng.uniform(-0.15, 0.15), 7)
+        tipo_negocio = rng.choice((1, 2))
+        created = now - rng.uniform(0, 3 * 365 * 86400)
+        updated = created + rng.uniform(0, now - created) if rng.random() < 0.4 else None
+        yield (
+            f"{rng.choice(CATALOGS['tipos_propiedad'])} en {city} #{number}",
+            ", ".join(rng.sample(WORDS, 5)).capitalize() + f". Propiedad {number} en {city}.",
+            rng.randrange(800, 25000) * 1000,
+            rng.randrange(8, 80) * 1000 if tipo_negocio == 2 else None,
+            rng.randrange(0, 6), rng.randrange(0, 3), rng.randrange(1, 5), rng.randrange(0, 4),
+            rng.randrange(1970, 2025), rng.randrange(90, 1200), rng.randrange(45, 600),
+            f"Calle {rng.randrange(1, 400)} #{rng.randrange(1, 3000)}", f"{rng.randrange(10000, 99999)}",
+            lat, lng, property_geohash(lat, lng), rng.randrange(0, 500), rng.random() < 0.3,
+            tipo_negocio, rng.randrange(1, len(CATALOGS['tipos_propiedad']) + 1),
+            rng.choices((1, 2, 3, 4), weights=(70, 15, 10, 5))[0],
+            rng.randrange(1, 26) if rng.random() < 0.7 else None,
+            rng.choices((1, 2), weights=(85, 15))[0],
+            rng.randrange(1, 4) if tipo_negocio == 2 else None,
+            rng.randrange(1, 5), estado_id, city_id + 1, rng.randrange(1, len(CATALOGS['zonas']) + 1),
+            rng.randrange(1, 26),
+            time.strftime('%Y-%m-%d %H:%M:%S+00', time.gmtime(created)),
+            time.strftime('%Y-%m-%d %H:%M:%S+00', time.gmtime(updated)) if updated else None,
+            time.strftime('%Y-%m-%d %H:%M:%S+00', time.gmtime(now)) if rng.random() < 0.05 else None,
+        )
+
+
+def generate_images(rng, scale):
+    for propiedad_id in range(1, scale + 1):
+        for orden in range(rng.choice((0, 1, 2, 3, 3, 4, 5))):
+            nombre = f"{propiedad_id}_{orden:02d}.jpg"
+            yield (propiedad_id, f"https://storage.bench.local/imagenes/{nombre}", nombre, orden == 0, orden)
+
+
+def chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def seed(scale, seed_value=42, skip_migrations=()):
+    from app import property_geohash
+
+    rng = random.Random(seed_value)
+    started = time.time()
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        print("🗄️  Schema + migrations")
+        apply_schema(cursor, skip_migrations)
+        seed_catalogs(cursor)
+        print(f"🏠 {scale} propiedades")
+        for chunk in chunks(generate_properties(rng, scale, property_geohash), COPY_CHUNK):
+            copy_rows(cursor, 'public.propiedades', PROPERTY_COPY_COLUMNS, chunk)
+        print("🖼️  Imágenes")
+        for chunk in chunks(generate_images(rng, scale), COPY_CHUNK):
+            copy_rows(cursor, 'public.propiedades_imagenes',
+                      ('propiedad_id', 'url', 'nombre_archivo', 'es_principal', 'orden'), chunk)
+        conn.commit()
+        conn.autocommit = True
+        cursor.execute("ANALYZE")
+        cursor.close()
+    finally:
+        conn.close()
+    print(f"✅ Seed listo en {time.time() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=1000, help='number of properties (e.g. 1000, 10000, 100000)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed; same seed, same data')
+    parser.add_argument('--skip-migration', action='append', default=[], metavar='PREFIX',
+                        help='skip migrations whose file name starts with PREFIX (e.g. 003 without unaccent)')
+    args = parser.parse_args()
+    seed(args.scale, args.seed, args.skip_migration)
+
+
+if __name__ == '__main__':
+    main()
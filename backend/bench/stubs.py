@@ -0,0 +1,120 @@
+"""
+In-process stand-ins for the Supabase auth and storage clients.
+
+install() puts them behind the app's get_supabase_client()/get_supabase_admin()
+seams (the _supabase_client / _supabase_admin_client globals), so endpoints
+run their real code paths without network calls. `latency_ms` adds a fixed
+delay to every call to imitate the round trip to Supabase.
+"""
+import os
+import threading
+import time
+import types
+import uuid
+
+BENCH_ADMIN_ID = '00000000-0000-4000-8000-000000000001'
+BENCH_JWT_SECRET = os.getenv('BENCH_JWT_SECRET', 'bench-secret-not-for-production-use-0001')
+BENCH_ADMIN_EMAIL = 'bench-admin@example.com'
+
+
+class _Latency:
+    def __init__(self, latency_ms):
+        self.delay = latency_ms / 1000.0
+
+    def wait(self):
+        if self.delay:
+            time.sleep(self.delay)
+
+
+class StubBucket:
+    def __init__(self, name, objects, lock, latency):
+        self.name = name
+        self._objects = objects
+        self._lock = lock
+        self._latency = latency
+
+    def upload(self, path, file, file_options=None):
+        self._latency.wait()
+        data = file.read() if hasattr(file, 'read') else file
+        with self._lock:
+            self._objects[path] = len(data)
+        return types.SimpleNamespace(path=path)
+
+    def get_public_url(self, path):
+        return f"https://storage.bench.local/{self.name}/{path}"
+
+    def remove(self, paths):
+        self._latency.wait()
+        with self._lock:
+            for path in paths:
+                self._objects.pop(path, None)
+        return []
+
+
+class StubStorage:
+    def __init__(self, latency):
+        self._objects = {}
+        self._lock = threading.Lock()
+        self._latency = latency
+
+    def from_(self, name):
+        return StubBucket(name, self._objects, self._lock, self._latency)
+
+
+class StubAdminAuth:
+    def __init__(self, latency):
+        self._latency = latency
+
+    def create_user(self, attributes):
+        self._latency.wait()
+        user = types.SimpleNamespace(id=str(uuid.uuid4()), email=attributes.get('email'))
+        return types.SimpleNamespace(user=user)
+
+    def delete_user(self, user_id):
+        self._latency.wait()
+
+
+class StubAuth:
+    def __init__(self, latency):
+        self._latency = latency
+        self.admin = StubAdminAuth(latency)
+
+    def _session(self):
+        user = types.SimpleNamespace(id=BENCH_ADMIN_ID, email=BENCH_ADMIN_EMAIL)
+        session = types.SimpleNamespace(access_token='bench-token', refresh_token='bench-refresh',
+                                        expires_in=3600, expires_at=int(time.time()) + 3600)
+        return types.SimpleNamespace(user=user, session=session)
+
+    def get_user(self, token=None):
+        self._latency.wait()
+        return types.SimpleNamespace(user=types.SimpleNamespace(id=BENCH_ADMIN_ID, email=BENCH_ADMIN_EMAIL))
+
+    def sign_in_with_password(self, credentials):
+        self._latency.wait()
+        return self._session()
+
+    def sign_up(self, credentials):
+        self._latency.wait()
+        return self._session()
+
+    def refresh_session(self, refresh_token=None):
+        self._latency.wait()
+        return self._session()
+
+    def sign_out(self, token=None):
+        self._latency.wait()
+
+
+class StubSupabaseClient:
+    def __init__(self, latency_ms=0):
+        latency = _Latency(latency_ms)
+        self.auth = StubAuth(latency)
+        self.storage = StubStorage(latency)
+
+
+def install(app_module, latency_ms=0):
+    """Sustituye los clientes Supabase del módulo app por los stubs. Devuelve el cliente instalado."""
+    client = StubSupabaseClient(latency_ms)
+    app_module._supabase_client = client
+    app_module._supabase_admin_client = client
+    return client
@@ -1,20 +1,63 @@
 import multiprocessing
 import os
+import sys
+import shutil
+import tempfile
 
 # Worker settings - Optimized for Render free tier
 workers = int(os.getenv('WEB_CONCURRENCY', 1))  # Keep 1 worker for free tier
-worker_class = 'sync'
-worker_connections = 1000
+
+# Concurrency inside each worker (GUNICORN_WORKER_CLASS):
+#   gthread - a thread per in-flight request; one DB connection per thread
+#   gevent  - green threads; psycopg2 made cooperative with psycogreen
+#   sync    - one request at a time (previous behaviour)
+# The DB pool (DB_POOL_MAX, read by app.py at import) is sized to match
+# unless it is set explicitly, plus one connection for background jobs
+# (image uploads/derivatives, visit counter flush).
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 100))
+
+if worker_class == 'gthread':
+    os.environ.setdefault('DB_POOL_MAX', str(threads + 1))
+elif worker_class == 'gevent':
+    # Requests beyond the pool size queue in the pool (DB_POOL_TIMEOUT)
+    # instead of opening more sessions against the Session Pooler.
+    os.environ.setdefault('DB_POOL_MAX', os.getenv('GEVENT_DB_POOL_MAX', '10'))
+else:
+    threads = 1
+    os.environ.setdefault('DB_POOL_MAX', '3')
+
+# Prometheus multiprocess store shared by all workers; must be set before
+# app.py (and prometheus_client) is imported, which preload_app does right
+# after this file is read. Without PROMETHEUS_MULTIPROC_DIR each master
+# creates a private directory and removes it on exit; a SIGHUP reload
+# (same pid, environment kept) reuses it. An operator supplied directory is
+# used as-is and never emptied.
+def owned_prometheus_dir():
+    """The multiprocess directory if this master created it, else None."""
+    pid, _, path = os.getenv('CASITA_PROMETHEUS_DIR_OWNER', '').partition(':')
+    if pid == str(os.getpid()) and path == os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        return path
+    return None
+
+if not os.getenv('PROMETHEUS_MULTIPROC_DIR') or (
+        os.getenv('CASITA_PROMETHEUS_DIR_OWNER') and not owned_prometheus_dir()):
+    # Unset, or inherited from another master (USR2 re-exec): use our own.
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='casita_prometheus_')
+    os.environ['CASITA_PROMETHEUS_DIR_OWNER'] = f"{os.getpid()}:{os.environ['PROMETHEUS_MULTIPROC_DIR']}"
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
 timeout = 300  # 5 minutes - critical for slow database connections
 keepalive = 5
 graceful_timeout = 30
 
 # Memory management
-max_requests = 200  # Restart worker after 200 requests
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 200))  # Restart worker after 200 requests (0 disables)
 max_requests_jitter = 20
 
 # Bind settings
-bind = '0.0.0.0:10000'  # Render uses port 10000
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"  # Render uses port 10000
 
 # Logging
 accesslog = '-'
@@ -23,14 +66,24 @@ loglevel = 'info'
 capture_output = True
 enable_stdio_inheritance = True
 
-# Preload app to save memory and initialize connections early
-preload_app = True
+# Preload app to save memory and initialize connections early. Not with
+# gevent: the app must be imported after the worker has monkey-patched.
+preload_app = worker_class != 'gevent'
+if preload_app:
+    # The master only imports the app; every worker opens its own DB
+    # connections in the background after fork (see post_fork).
+    os.environ['DB_WARMUP_AFTER_FORK'] = '1'
 
 # Startup hooks
 def on_starting(server):
     """Called just before the master process is initialized."""
     print("🚀 Starting Gunicorn server...")
-    print(f"⚙️  Workers: {workers}")
+    prometheus_dir = owned_prometheus_dir()
+    if prometheus_dir:
+        # Files written by the preloaded app in the master; workers write their own.
+        for name in os.listdir(prometheus_dir):
+            os.remove(os.path.join(prometheus_dir, name))
+    print(f"⚙️  Workers: {workers} ({worker_class}, threads: {threads}, DB pool: {os.environ['DB_POOL_MAX']})")
     print(f"⏱️  Timeout: {timeout}s")
 
 def when_ready(server):
@@ -38,6 +91,30 @@ def when_ready(server):
     print("✅ Gunicorn server is ready and listening!")
     print(f"🌐 Listening on: {bind}")
 
+def post_fork(server, worker):
+    """Called in the worker just after fork: gevent-friendly psycopg2, then DB warm-up."""
+    if worker_class == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    if preload_app:
+        sys.modules['app'].start_db_warmup()
+
+def child_exit(server, worker):
+    """Called in the master after a worker exits: drop its live gauges from /metrics."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+def worker_exit(server, worker):
+    """Called in the worker process as it exits: write buffered visit counts."""
+    from app import flush_visit_counts
+    flush_visit_counts()
+
 def on_exit(server):
     """Called just before the master process exits."""
+    app_module = sys.modules.get('app')  # only loaded here with preload_app
+    if app_module:
+        app_module.flush_visit_counts()
+    prometheus_dir = owned_prometheus_dir()
+    if prometheus_dir:
+        shutil.rmtree(prometheus_dir, ignore_errors=True)
     print("👋 Shutting down Gunicorn server...")
\ No newline at end of file
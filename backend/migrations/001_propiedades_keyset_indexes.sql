@@ -0,0 +1,9 @@
+-- Keyset pagination for GET /api/propiedades
+-- Pages seek on p.id DESC among live rows; images are looked up per property.
+
+CREATE INDEX IF NOT EXISTS idx_propiedades_live_id
+    ON public.propiedades (id DESC)
+    WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_propiedades_imagenes_propiedad_orden
+    ON public.propiedades_imagenes (propiedad_id, orden);
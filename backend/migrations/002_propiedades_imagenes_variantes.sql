@@ -0,0 +1,6 @@
+-- Resized/WebP derivatives of each image, e.g.
+-- {"thumb": "...", "thumb_webp": "...", "medium": "...", "medium_webp": "..."}
+-- NULL until generated at upload time or by `flask --app app backfill-derivatives`.
+
+ALTER TABLE public.propiedades_imagenes
+    ADD COLUMN IF NOT EXISTS variantes jsonb;
@@ -0,0 +1,30 @@
+-- Full-text search for GET /api/propiedades?q=
+-- Spanish stemming with accent-insensitive matching ("jardin" finds "jardín"),
+-- weighted titulo (A) > direccion (B) > descripcion (C) for ranking.
+
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_ts_config c
+        JOIN pg_namespace n ON n.oid = c.cfgnamespace
+        WHERE c.cfgname = 'spanish_unaccent' AND n.nspname = 'public'
+    ) THEN
+        CREATE TEXT SEARCH CONFIGURATION public.spanish_unaccent (COPY = pg_catalog.spanish);
+        ALTER TEXT SEARCH CONFIGURATION public.spanish_unaccent
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+    END IF;
+END
+$$;
+
+ALTER TABLE public.propiedades
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('public.spanish_unaccent', coalesce(titulo, '')), 'A') ||
+        setweight(to_tsvector('public.spanish_unaccent', coalesce(direccion, '')), 'B') ||
+        setweight(to_tsvector('public.spanish_unaccent', coalesce(descripcion, '')), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_propiedades_search_vector
+    ON public.propiedades USING gin (search_vector);
@@ -0,0 +1,6 @@
+-- Spatial index for ?bbox= and ?near=&radius_km= on GET /api/propiedades.
+-- The expression must match GEO_POINT_SQL in app.py.
+
+CREATE INDEX IF NOT EXISTS idx_propiedades_geo_point
+    ON public.propiedades USING gist (point(lng::float8, lat::float8))
+    WHERE deleted_at IS NULL;
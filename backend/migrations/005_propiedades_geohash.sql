@@ -0,0 +1,8 @@
+-- Precomputed geohash per property for GET /api/propiedades/clusters.
+-- Written by add_property/update_property/import; fill existing rows with
+-- `flask --app app backfill-geohash`. Not indexed: the clusters query groups
+-- by left(geohash, n) inside the bbox filter (served by the geo index in
+-- migrations/004) and never filters on a geohash prefix.
+
+ALTER TABLE public.propiedades
+    ADD COLUMN IF NOT EXISTS geohash varchar(12);
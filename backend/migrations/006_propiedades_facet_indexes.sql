@@ -0,0 +1,23 @@
+-- Partial indexes for the facet filters of GET /api/propiedades/search
+-- (and the same filters on GET /api/propiedades). Each id facet is paired
+-- with precio so "ciudad X between A and B" stays an index range scan.
+
+CREATE INDEX IF NOT EXISTS idx_propiedades_ciudad_precio
+    ON public.propiedades (ciudad_id, precio)
+    WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_propiedades_zona_precio
+    ON public.propiedades (zona_id, precio)
+    WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_propiedades_tipo_propiedad_precio
+    ON public.propiedades (tipo_propiedad_id, precio)
+    WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_propiedades_moneda_precio
+    ON public.propiedades (moneda_id, precio)
+    WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_propiedades_habitaciones_banos
+    ON public.propiedades (habitaciones, banos)
+    WHERE deleted_at IS NULL;